@@ -0,0 +1,71 @@
+import gzip
+import json
+import os
+from threading import Lock
+
+from models import Game
+
+archive_dir = "archive"
+games_window = 50  # finished games kept in chat_data, the older ones are moved to the archive
+
+__lock = Lock()
+# only the history of the game is archived, not its board
+__skipped_keys = ['table_grid', 'board_words']
+
+
+def archive_games(chat_id: int, games: list):
+    """Append the given games to the archive of the chat, a file of gzipped JSON lines."""
+    os.makedirs(archive_dir, exist_ok=True)
+    lines = "".join(json.dumps({key: value for key, value in game.to_dict().items() if key not in __skipped_keys},
+                               default=__encode, ensure_ascii=False) + "\n"
+                    for game in games)
+    with __lock:
+        # each append is a new gzip member, and gzip reads multiple members as a single stream
+        with gzip.open(__get_archive_path(chat_id), 'at', encoding='utf-8') as f:
+            f.write(lines)
+
+
+def load_games(chat_id: int, last_n: int = None) -> list:
+    """Return the archived games of the chat, from the oldest to the newest, or only the last_n ones."""
+    path = __get_archive_path(chat_id)
+    if not os.path.isfile(path):
+        return []
+    with __lock:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = f.readlines()
+    if last_n is not None:
+        lines = lines[-last_n:] if last_n > 0 else []
+    return [__decode(json.loads(line)) for line in lines]
+
+
+def archive_old_games(chat_id: int, chat_data: dict):
+    """Move the games exceeding games_window from chat_data to the archive."""
+    games = chat_data.get('games', [])
+    if len(games) <= games_window:
+        return
+    old_games = games[:len(games) - games_window]
+    archive_games(chat_id, old_games)
+    del games[:len(old_games)]
+    chat_data['archived_games'] = chat_data.get('archived_games', 0) + len(old_games)
+
+
+def __get_archive_path(chat_id: int) -> str:
+    return os.path.join(archive_dir, f"{chat_id}.jsonl.gz")
+
+
+def __encode(obj):
+    if hasattr(obj, 'to_dict'):  # Telegram objects
+        return obj.to_dict()
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} can't be archived")
+
+
+def __decode(game: dict) -> Game:
+    # JSON turns the user ids used as keys into strings
+    game['participants'] = {int(user_id): participant for user_id, participant in game['participants'].items()}
+    if game.get('winners'):
+        game['winners'] = {int(user_id): username for user_id, username in game['winners'].items()}
+    if game.get('scores'):
+        game['scores'] = {int(user_id): points for user_id, points in game['scores'].items()}
+    return Game.from_dict(game)
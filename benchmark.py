@@ -0,0 +1,299 @@
+"""
+Benchmarks for the game logic of the bot, run with: python benchmark.py [--output results.json] [--compare old.json]
+The results are written to a JSON file, so that they can be compared with the ones of a previous release.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from copy import deepcopy
+from time import time
+from timeit import Timer
+from types import SimpleNamespace
+
+# the bot reads its configuration from the environment as soon as it's imported
+os.environ.setdefault("TOKEN", "benchmark")
+os.environ.setdefault("CST_CID", "0")
+
+import boggle_telegram_bot as bot  # noqa: E402
+import leaderboards  # noqa: E402
+import rankings  # noqa: E402
+from boards import generate_board, get_formatted_table  # noqa: E402
+from dice import get_shuffled_dice  # noqa: E402
+from dictionary import get_dictionary  # noqa: E402
+from loadtest import get_traceable_words  # noqa: E402
+from models import Game, Participant, WordEntry, UserStats  # noqa: E402
+from persistence import SQLitePersistence  # noqa: E402
+from solver import get_table_grid, solve_board  # noqa: E402
+from translations import get_string  # noqa: E402
+
+group_id = -1
+languages = ['ita', 'eng']
+dimensions = ['4x4', '5x5']
+results = {}
+sizes = {}
+
+
+def get_context(participants: dict) -> SimpleNamespace:
+    game = Game(lang='eng')
+    game.participants = participants
+    return SimpleNamespace(bot_data={'games': {group_id: game}}, chat_data={})
+
+
+def get_participants(players: int, words_per_player: int = 60) -> dict:
+    # draw from a small vocabulary so that there are plenty of words in common
+    random.seed(players)
+    vocabulary = ["".join(random.choice("aeiourstlnmcdp") for _ in range(random.randint(3, 7)))
+                  for _ in range(words_per_player * 4)]
+    return {user_id: Participant(f"player{user_id}", {word: WordEntry(1)
+                                                      for word in random.sample(vocabulary, words_per_player)})
+            for user_id in range(players)}
+
+
+def check_words_in_common_quadratic(context, group_id: int):
+    # the implementation replaced by the counting pass, kept here as a baseline
+    players = context.bot_data['games'][group_id].participants
+    players_2 = players.copy()
+    for player in players:
+        del players_2[player]
+        words = players[player].words
+        for word in words:
+            if not words[word].sent_by_other_players:
+                for player_2 in players_2:
+                    words_2 = players_2[player_2].words
+                    for word_2 in words_2:
+                        if not words_2[word_2].sent_by_other_players:
+                            if word == word_2:
+                                words[word].sent_by_other_players = True
+                                words_2[word_2].sent_by_other_players = True
+
+
+def best_of(function, setup, repeat: int = 5, number: int = 1) -> float:
+    """Return the best time in milliseconds of number calls of function, each one with fresh data from setup."""
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        times.append(Timer(lambda: function(*args)).timeit(number) / number * 1000)
+    return min(times)
+
+
+def record(name: str, ms: float):
+    results[name] = ms
+    print(f"    {name:<45} {ms:10.4f} ms")
+
+
+def record_size(name: str, kb: float):
+    sizes[name] = kb
+    print(f"    {name:<45} {kb:10.1f} KB")
+
+
+def get_size(obj, seen: set = None) -> int:
+    """Return the memory taken by obj and by all the objects it references, each one counted once."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, (type, type(None), bool)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_size(key, seen) + get_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_size(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(get_size(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+
+def get_game(lang: str, dim: str, players: int = 10, words_per_player: int = 30) -> Game:
+    """Return a running game on a random board, with the players having sent words which can be traced on it."""
+    random.seed(f"{lang}{dim}{players}")
+    board = generate_board(lang, dim)
+    game = Game(int(time()), 0, "player0", lang, dim)
+    game.table_str = board['table_str']
+    game.table_grid = board['table_grid']
+    game.board_words = board['words']
+    game.participants = {user_id: Participant(f"player{user_id}",
+                                              {word: WordEntry(bot.get_points_for_word(word, dim))
+                                               for word in get_traceable_words(board['table_grid'], words_per_player)})
+                         for user_id in range(players)}
+    return game
+
+
+def bench_game_logic():
+    validate_word = getattr(bot, "__validate_word_by_boggle_rules")
+    check_words_in_common = getattr(bot, "__check_words_in_common")
+    get_formatted_words = getattr(bot, "__get_formatted_words")
+    print("game logic")
+    for lang in languages:
+        for dim in dimensions:
+            game = get_game(lang, dim)
+            words = [word.replace("qu", "q") for word in get_traceable_words(game.table_grid, 100)]
+            without_board_words = deepcopy(game)
+            without_board_words.board_words = frozenset()
+            record_size(f"a game of 10 players {lang} {dim}", get_size(game) / 1024)
+            record_size(f"the participants of a game {lang} {dim}", get_size(game.participants) / 1024)
+            record(f"validate 100 words (board words) {lang} {dim}",
+                   best_of(lambda: [validate_word(word, game) for word in words], lambda: ()))
+            record(f"validate 100 words (tracing) {lang} {dim}",
+                   best_of(lambda: [validate_word(word, without_board_words) for word in words], lambda: ()))
+            record(f"check words in common {lang} {dim}",
+                   best_of(check_words_in_common, lambda: (get_context(deepcopy(game.participants)), group_id)))
+            context = get_context(game.participants)
+            context.bot_data['games'][group_id] = game
+            record(f"format the words of all players {lang} {dim}",
+                   best_of(lambda: [get_formatted_words(context, group_id, with_points=True, user_id=user_id)
+                                    for user_id in game.participants], lambda: bot.formatted_words.clear() or ()))
+            record(f"format the words of all players again {lang} {dim}",
+                   best_of(lambda: [get_formatted_words(context, group_id, with_points=True, user_id=user_id)
+                                    for user_id in game.participants], lambda: ()))
+            record(f"format 100 tables {lang} {dim}",
+                   best_of(get_formatted_table, lambda: (get_shuffled_dice(lang, dim),), number=100) * 100)
+            record(f"shuffle the dice 100 times {lang} {dim}",
+                   best_of(get_shuffled_dice, lambda: (lang, dim), number=100) * 100)
+            dictionary = get_dictionary(lang)
+            if dictionary:
+                grids = [get_table_grid(get_shuffled_dice(lang, dim)) for _ in range(10)]
+                record(f"solve 10 boards {lang} {dim}",
+                       best_of(lambda: [solve_board(grid, dictionary) for grid in grids], lambda: ()))
+        record(f"get 1000 strings {lang}",
+               best_of(lambda: [get_string(lang, 'game_created', "player", 90, "") for _ in range(1000)],
+                       lambda: ()))
+
+
+def bench_persistence(groups: int = 50):
+    print(f"persistence with {groups} running games")
+    workdir = tempfile.mkdtemp(prefix="boggle_benchmark_")
+    persistence = SQLitePersistence(filename=os.path.join(workdir, "db.sqlite"), store_user_data=False)
+    chat_data = {}
+    bot_data = {'games': {}, 'stats': {'users': {}, 'groups': {}}, 'user_games': {0: [-1]}}
+    for group in range(groups):
+        game = get_game(languages[group % 2], dimensions[group % 2], players=4)
+        chat_data[-group - 1] = {'games': [game]}
+        bot_data['games'][-group - 1] = game
+        for user_id in game.participants:
+            stats = bot_data['stats']['users'][group * 4 + user_id] = UserStats(f"player{user_id}")
+            stats.add_game("won", 1, (("word", 1),))
+    for chat_id in chat_data:
+        persistence.update_chat_data(chat_id, chat_data[chat_id])
+    persistence.update_bot_data(bot_data)
+    record_size("the statistics of a player", get_size(next(iter(bot_data['stats']['users'].values()))) / 1024)
+
+    def add_word(player: Participant):
+        player.words[f"word{len(player.words)}"] = WordEntry(1)
+
+    def update_after_word():
+        # what the dispatcher saves after a word is sent by a player in their private chat
+        add_word(bot_data['games'][-1].participants[0])
+        persistence.update_bot_data(bot_data)
+        persistence.update_chat_data(0, {})
+
+    record("update the bot data after a word", best_of(update_after_word, lambda: (), number=10))
+    record("update the chat data of a group",
+           best_of(lambda: persistence.update_chat_data(-1, chat_data[-1]), lambda: (), number=10))
+    record("flush", best_of(persistence.flush, lambda: (), number=1))
+    record_size("database", os.path.getsize(os.path.join(workdir, "db.sqlite")) / 1024)
+
+
+def bench_check_words_in_common():
+    check_words_in_common = getattr(bot, "__check_words_in_common")
+    print("__check_words_in_common")
+    for players in [2, 10, 50]:
+        participants = get_participants(players)
+
+        def setup():
+            return get_context(deepcopy(participants)), group_id
+
+        old = best_of(check_words_in_common_quadratic, setup)
+        new = best_of(check_words_in_common, setup)
+        # both implementations must strike the same words
+        old_context, new_context = setup()[0], setup()[0]
+        check_words_in_common_quadratic(old_context, group_id)
+        check_words_in_common(new_context, group_id)
+        assert all(old.to_dict() == new.to_dict() for old, new in zip(
+            old_context.bot_data['games'][group_id].participants.values(),
+            new_context.bot_data['games'][group_id].participants.values()))
+        print(f"    {players:>3} players: {old:10.3f} ms -> {new:8.3f} ms ({old / new:.0f}x)")
+        results[f"check words in common {players} players"] = new
+
+
+def bench_leaderboards(users: int = 10000):
+    print(f"leaderboards of {users} players")
+    random.seed(users)
+    all_stats = {}
+    for user_id in range(users):
+        stats = all_stats[user_id] = UserStats(f"player{user_id}")
+        for _ in range(random.randint(1, 20)):
+            stats.add_game(random.choice(["won", "even", "lost"]), random.randint(0, 50), ())
+
+    def end_game():
+        # what end_game does for each of the 4 players of a game
+        for user_id in random.sample(range(users), 4):
+            all_stats[user_id].add_game("won", random.randint(0, 50), ())
+            leaderboards.update(None, user_id, all_stats[user_id])
+
+    leaderboards.clear()
+    record("build the leaderboards", best_of(leaderboards.get_top, lambda: leaderboards.clear() or
+                                             (None, 'points', all_stats)))
+    record("update the leaderboards after a game", best_of(end_game, lambda: (), number=100))
+    for metric in leaderboards.metrics:
+        record(f"show the leaderboard by {metric}",
+               best_of(leaderboards.get_top, lambda: (None, metric, all_stats), number=100))
+    leaderboards.clear()
+
+
+def bench_rankings(games: int = 1000):
+    print(f"/last with {games} games")
+    random.seed(games)
+    ended_games = []
+    for unix_epoch in range(games):
+        game = Game(unix_epoch)
+        game.participants = {user_id: Participant(f"player{user_id}") for user_id in random.sample(range(20), 4)}
+        game.scores = {user_id: random.randint(0, 50) for user_id in game.participants}
+        ended_games.append(game)
+    group = -games  # a group which nothing else ranks
+    record(f"rank the last {games} games the first time",
+           best_of(lambda: rankings.get_ranking(group, games, lambda: ended_games), lambda: (), repeat=1))
+    record(f"rank the last {games} games", best_of(rankings.get_ranking, lambda: (group, games, None), number=100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the game logic of the bot.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file where the results are written")
+    parser.add_argument("--compare", help="JSON file with the results of a previous run")
+    args = parser.parse_args()
+
+    bench_check_words_in_common()
+    bench_game_logic()
+    bench_persistence()
+    bench_leaderboards()
+    bench_rankings()
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': int(time()),
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'results_ms': results,
+            'sizes_kb': sizes
+        }, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"compared to {args.compare}")
+        for name in results:
+            if name in previous['results_ms'] and results[name] > 0:
+                print(f"    {name:<45} {previous['results_ms'][name]:10.4f} ms -> {results[name]:10.4f} ms"
+                      f" ({previous['results_ms'][name] / results[name]:.2f}x)")
+        for name in sizes:
+            if name in previous.get('sizes_kb', {}) and sizes[name] > 0:
+                print(f"    {name:<45} {previous['sizes_kb'][name]:10.1f} KB -> {sizes[name]:10.1f} KB"
+                      f" ({previous['sizes_kb'][name] / sizes[name]:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, Future
+from math import sqrt
+from threading import Thread, Lock, Event
+
+from dice import dice, get_shuffled_dice
+from dictionary import get_dictionary
+from solver import get_table_grid, solve_board, get_points_for_word
+
+logger = logging.getLogger(__name__)
+
+# a board is played only if it has at least this many words, points and letters in its longest word
+min_board_score = {
+    '4x4': {
+        'words': 30,
+        'points': 40,
+        'longest': 6
+    },
+    '5x5': {
+        'words': 60,
+        'points': 100,
+        'longest': 7
+    }
+}
+max_rolls = 50  # if none of the boards reaches the minimum score, the best one is played anyway
+workers = 2
+pool_size = 5  # boards kept ready for each language and table dimensions
+pool_filename = '_boggle_board_pool'  # set to None to keep the pool in memory only
+
+__executor = None
+__pool = {}
+__pool_lock = Lock()
+__pool_changed = Event()
+
+
+def generate_board(lang: str, table_dimensions: str) -> dict:
+    """
+    Roll the dice until the board reaches the minimum score for its dimensions, and return the board as a dict with
+    the shuffled dice, the table grid, the set of words which can be found on it and its score.
+    Without a dictionary for the language the boards can't be scored, so the first roll is returned.
+    """
+    dictionary = get_dictionary(lang)
+    best = None
+    for _ in range(max_rolls if dictionary else 1):
+        table_list = get_shuffled_dice(lang, table_dimensions)
+        table_grid = get_table_grid(table_list)
+        words = solve_board(table_grid, dictionary) if dictionary else set()
+        board = {
+            'table_list': table_list,
+            'table_str': get_formatted_table(table_list),
+            'table_grid': table_grid,
+            'words': words,
+            'score': get_board_score(words, table_dimensions)
+        }
+        if best is None or board['score']['points'] > best['score']['points']:
+            best = board
+        if all(board['score'][key] >= min_board_score[table_dimensions][key] for key in board['score']):
+            return board
+    if dictionary:
+        logger.info(f"No {table_dimensions} board for language {lang} reached the minimum score in {max_rolls} rolls,"
+                    f" using the best one: {best['score']}")
+    return best
+
+
+def get_board_score(words: set, table_dimensions: str) -> dict:
+    score = {
+        'words': 0,
+        'points': 0,
+        'longest': 0
+    }
+    for word in words:
+        points = get_points_for_word(word.replace("q", "qu"), table_dimensions)
+        if points > 0:
+            score['words'] += 1
+            score['points'] += points
+            score['longest'] = max(score['longest'], len(word.replace("q", "qu")))
+    return score
+
+
+def submit_board(lang: str, table_dimensions: str) -> Future:
+    """Generate a board in a worker process, so that the dispatcher isn't blocked while the boards are scored."""
+    global __executor
+    if __executor is None:
+        __executor = ProcessPoolExecutor(max_workers=workers)
+    return __executor.submit(generate_board, lang, table_dimensions)
+
+
+def start_board_pool():
+    """Load the saved boards, if any, and start refilling the pool in the background."""
+    if pool_filename and os.path.isfile(pool_filename):
+        try:
+            with open(pool_filename, 'rb') as f:
+                __pool.update(pickle.load(f))
+            # boards saved before the grid became a flat string
+            for boards in __pool.values():
+                for board in boards:
+                    if not isinstance(board['table_grid'], str):
+                        board['table_grid'] = get_table_grid(board['table_list'])
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.exception(f"Could not load the board pool from {pool_filename}, it will be generated again.")
+    Thread(target=__refill_pool, name="board_pool", daemon=True).start()
+
+
+def pop_board(lang: str, table_dimensions: str):
+    """Return a ready board for the given language and table dimensions, or None if the pool is empty."""
+    with __pool_lock:
+        boards = __pool.get((lang, table_dimensions))
+        board = boards.pop() if boards else None
+    __pool_changed.set()
+    return board
+
+
+def get_formatted_table(shuffled_dice: list) -> str:
+    # assuming the table is always an NxN square
+    total_num = len(shuffled_dice)
+    row_col_num = int(sqrt(total_num))
+
+    Qu_is_in_table = "Qu" in shuffled_dice
+
+    formatted_table = ""
+    for i in range(0, total_num, row_col_num):
+        formatted_table += "  |  ".join(shuffled_dice[i:i + row_col_num]) + "\n"
+        if i != total_num - row_col_num:
+            formatted_table += "---|--" * (row_col_num - 1) + "-\n"
+
+    if Qu_is_in_table:
+        lines = formatted_table.splitlines()
+        formatted_table = ""
+        index_u = -1
+        for line in lines:
+            if "Qu" in line:
+                index_u = line.index("u")
+                break
+
+        for line in lines:
+            if "Qu" not in line:
+                formatted_table += line[:index_u]
+                if "-" not in line:
+                    formatted_table += " "
+                else:
+                    formatted_table += "-"
+                formatted_table += line[index_u:]
+            else:
+                formatted_table += line
+            formatted_table += "\n"
+
+    return f"<code>{formatted_table}</code>"
+
+
+def __refill_pool():
+    keys = [(lang, table_dimensions) for lang in dice for table_dimensions in dice[lang]]
+    while True:
+        __pool_changed.clear()
+        refilled = False
+        for key in keys:
+            while len(__pool.get(key, [])) < pool_size:
+                try:
+                    board = submit_board(*key).result()
+                except Exception:
+                    logger.exception(f"Could not generate a board for the pool {key}")
+                    break
+                with __pool_lock:
+                    __pool.setdefault(key, []).append(board)
+                refilled = True
+        if refilled and pool_filename:
+            __save_pool()
+        __pool_changed.wait()
+
+
+def __save_pool():
+    with __pool_lock:
+        data = pickle.dumps(__pool)
+    tmp = pool_filename + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, pool_filename)
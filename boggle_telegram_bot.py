@@ -5,20 +5,36 @@
 This bot was made by e-caste in 2020
 """
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.parsemode import ParseMode
 from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters,
-                          CallbackQueryHandler, PicklePersistence)
+                          CallbackQueryHandler)
 from telegram.utils.helpers import mention_html
 from telegram.error import Unauthorized, BadRequest
 import logging
 import os
 import shutil
+import sqlite3
 import sys
 import traceback
 from translations import get_string
-from threading import Timer
-from dice import get_shuffled_dice, letters_sets
+from types import SimpleNamespace
+from functools import wraps
+from threading import Thread, RLock
+from io import BytesIO
+from dice import letters_sets
+from solver import can_trace_word, get_points_for_word
+from models import Game, Participant, WordEntry, UserStats, GroupStats
+from dictionary import get_dictionary, load_dictionaries
+from boards import generate_board, submit_board, pop_board, start_board_pool
+from persistence import SQLitePersistence
+from archive import archive_old_games, load_games
+import leaderboards
+import rankings
+from metrics import timed, MetricsRequest, start_metrics_server
+from profiler import profile, max_duration as max_profile_duration
+from delivery import send_messages, edit_messages, enqueue_notifications, start_notifications, \
+    workers as delivery_workers
 from math import sqrt
 from time import time
 
@@ -32,6 +48,20 @@ else:
     token = os.environ["TOKEN"]
     castes_chat_id = os.environ["CST_CID"]
 
+# another Bot API server, such as a local one or the fake one of loadtest.py, e.g. http://127.0.0.1:8081/bot
+bot_api_url = os.environ.get("BOT_API_URL")
+# serve the metrics of the handlers and of the Bot API requests on this port if set, see metrics.py
+metrics_port = os.environ.get("METRICS_PORT")
+# receive the updates with a webhook instead of polling for them if WEBHOOK_URL is set, e.g. https://example.com:8443
+webhook_url = os.environ.get("WEBHOOK_URL")
+webhook_listen = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+webhook_port = int(os.environ.get("WEBHOOK_PORT", 8443))
+# only Telegram knows the path of the webhook, so that nobody else can send updates to the bot
+webhook_path = os.environ.get("WEBHOOK_PATH") or token
+# a self-signed certificate, if there isn't a reverse proxy or a load balancer handling TLS in front of the bot
+webhook_cert = os.environ.get("WEBHOOK_CERT")
+webhook_key = os.environ.get("WEBHOOK_KEY")
+
 # Enable logging
 level = logging.DEBUG if debug else logging.INFO
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -39,13 +69,30 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 logger = logging.getLogger(__name__)
 
-timers = {
-    'newgame': {},
-    'ingame': {}
-}
+# group_id -> future of the board being generated for a game, lost if the bot is restarted
+pending_boards = {}
+# group_id -> the game which was being played when the bot was restarted, but can't go on since its board hadn't been
+# dealt yet or its deadline wasn't saved, canceled as soon as the group is used again
+unrecoverable_games = {}
+# chat_id -> lock held while an update or a timer of the chat is handled, since the handlers run concurrently
+chat_locks = {}
+dispatcher_workers = 16
+# functions called with user_id, group_id and True when a user joins a game, or False when they leave it
+user_games_listeners = []
+# functions called with group_id and True when the board of a game is dealt, or False when the game ends or is killed
+running_games_listeners = []
+# functions called with user_id, username, result, points and (word, points) of each word of each player of a game
+# which has ended, after they've been added to the statistics of the user
+user_results_listeners = []
+# group_id -> user_id -> the formatted words of the player in the running game, for each with_points and only_valid,
+# kept until the words of the player change
+formatted_words = {}
 
 spam_interval = 4  # hours
 
+db_filename = os.path.join("db", "_boggle_paroliere_bot_db.sqlite")
+legacy_db_filename = "_boggle_paroliere_bot_db"  # migrated to db_filename on the first start
+
 
 def start(update, context):
     __check_bot_data_is_initialized(context)
@@ -105,11 +152,9 @@ def new(update, context):
         cd['notify']['withoutspam'] = {}
 
     if not cd['timers']['newgame']:
-        t = Timer(interval=cd['timers']['durations']['newgame'],
-                  function=__newgame_timer, args=(update, context))
-        t.start()
-        cd['timers']['newgame'] = t.name
-        timers['newgame'][group_chat_id] = t.cancel  # pass callable
+        # the deadline is saved so that the timer can be scheduled again if the bot is restarted
+        cd['timers']['newgame'] = time() + cd['timers']['durations']['newgame']
+        __schedule_timer(context, 'newgame', group_chat_id, cd['timers']['newgame'])
 
         message = context.bot.send_message(chat_id=__get_chat_id(update),
                                            text=get_string(__get_chat_lang(context), 'game_created',
@@ -121,50 +166,29 @@ def new(update, context):
         creator_id = __get_user_id(update)
         if not cd.get('games'):
             cd['games'] = []
-        cd['games'].append({
-            'unix_epoch': int(time()),
-            'creator': {
-                'id': creator_id,
-                'username': __get_username(update)
-            },
-            'participants': {},
-            'is_finished': False,
-            'ingame_timer': None,
-            'lang': __get_chat_lang(context),
-            'dim': cd['settings']['table_dimensions'],
-            'newgame_message': message
-        })
+        cd['games'].append(Game(unix_epoch=int(time()),
+                                creator_id=creator_id,
+                                creator_username=__get_username(update),
+                                lang=__get_chat_lang(context),
+                                dim=cd['settings']['table_dimensions'],
+                                newgame_message_id=message.message_id))
         if cd['settings']['auto_join']:
             join(update, context)  # auto-join game creator
-        for user_id in cd['notify']['justonce']:
-            try:
-                if user_id != creator_id:
-                    context.bot.send_message(chat_id=user_id,
-                                             text=get_string(__get_chat_lang(context), 'notify_newgame',
-                                                             __get_group_name(update)),
-                                             parse_mode=HTML)
-            except BadRequest:
-                pass
-        cd['notify']['justonce'] = []  # remove all user_ids since they've been notified
-        for user_id in cd['notify']['allgames']:
-            try:
-                if user_id != creator_id:
-                    context.bot.send_message(chat_id=user_id,
-                                             text=get_string(__get_chat_lang(context), 'notify_newgame',
-                                                             __get_group_name(update)),
-                                             parse_mode=HTML)
-            except BadRequest:
-                pass
+        # the notifications are sent in the background, and each user receives only one even if they're in more than
+        # one list, whose user_ids are strings since they're taken from the data of the buttons of /notify
+        recipients = {}
+        for user_id in cd['notify']['justonce'] + cd['notify']['allgames']:
+            recipients[str(user_id)] = int(user_id)
         for user_id in cd['notify']['withoutspam']:
-            try:
-                if user_id != creator_id and time() > cd['notify']['withoutspam'][user_id] + spam_interval * 3600:
-                    cd['notify']['withoutspam'][user_id] = time()
-                    context.bot.send_message(chat_id=user_id,
-                                             text=get_string(__get_chat_lang(context), 'notify_newgame',
-                                                             __get_group_name(update)),
-                                             parse_mode=HTML)
-            except BadRequest:
-                pass
+            if str(user_id) != str(creator_id) and \
+                    time() > cd['notify']['withoutspam'][user_id] + spam_interval * 3600:
+                cd['notify']['withoutspam'][user_id] = time()
+                recipients[str(user_id)] = int(user_id)
+        recipients.pop(str(creator_id), None)
+        cd['notify']['justonce'] = []  # remove all user_ids since they'll be notified
+        enqueue_notifications(context.bot, recipients.values(),
+                              get_string(__get_chat_lang(context), 'notify_newgame', __get_group_name(update)),
+                              parse_mode=HTML)
 
     else:
         context.bot.send_message(chat_id=__get_chat_id(update),
@@ -209,11 +233,11 @@ def join(update, context):
     if cd['timers']['newgame'] and current_game is not None:
         user_id = __get_user_id(update)
 
-        if current_game['participants'].get(user_id):
+        if current_game.participants.get(user_id):
             context.bot.send_message(chat_id=group_chat_id,
                                      text=get_string(__get_chat_lang(context), 'already_in_game',
                                                      __get_username(update),
-                                                     current_game['creator']['username']),
+                                                     current_game.creator_username),
                                      parse_mode=HTML)
         else:
             if group_chat_id not in bd['stats']['groups']:
@@ -221,24 +245,24 @@ def join(update, context):
 
             if not bd['stats']['users'].get(user_id):  # user has never played
                 __init_user_stats(context, user_id, __get_username(update), group_chat_id, new_player=True)
-            elif not bd['stats']['groups'][group_chat_id].get(user_id):  # user has already played in other groups
+            elif user_id not in bd['stats']['groups'][group_chat_id].players:  # user has played in other groups
                 __init_user_stats(context, user_id, __get_username(update), group_chat_id, new_player=False)
 
             __join_user_to_game(update, context)
             context.bot.send_message(chat_id=group_chat_id,
                                      text=get_string(__get_chat_lang(context), 'game_joined',
-                                                     __get_username(update), current_game['creator']['username']),
+                                                     __get_username(update), current_game.creator_username),
                                      parse_mode=HTML)
             logger.info(f"User {__get_user_for_log(update)} joined a game in group"
                         f" {__get_group_name(update)} - {__get_chat_id(update)}")
             usernames = ""
-            for user_id in current_game['participants']:
-                usernames += current_game['participants'][user_id]['username'] + ", "
+            for user_id in current_game.participants:
+                usernames += current_game.participants[user_id].username + ", "
             usernames = f"<b>{usernames[:-2]}</b>"
             context.bot.edit_message_text(chat_id=group_chat_id,
-                                          message_id=current_game['newgame_message']['message_id'],
+                                          message_id=current_game.newgame_message_id,
                                           text=get_string(__get_chat_lang(context), 'game_created',
-                                                          current_game['creator']['username'],
+                                                          current_game.creator_username,
                                                           cd['timers']['durations']['newgame'], usernames),
                                           parse_mode=HTML)
 
@@ -263,19 +287,21 @@ def leave(update, context):
 
     if bd['games'].get(group_chat_id):
         game = bd['games'][group_chat_id]
-        if game['participants'].get(user_id):
-            if not game['is_finished']:
+        if game.participants.get(user_id):
+            if not game.is_finished:
                 context.bot.send_message(chat_id=group_chat_id,
                                          text=get_string(__get_chat_lang(context), 'game_left',
                                                          __get_username(update)),
                                          parse_mode=HTML)
-                del game['participants'][user_id]
+                del game.participants[user_id]
+                __unindex_user_game(context, user_id, group_chat_id)
+                __forget_formatted_words(group_chat_id, user_id)
                 logger.info(f"User {__get_user_for_log(update)} left a game in group"
                             f" {__get_group_name(update)} - {__get_chat_id(update)}")
             else:
                 context.bot.send_message(chat_id=group_chat_id,
                                          text=get_string(__get_chat_lang(context), 'game_already_finished_leave',
-                                                         bd['games'][group_chat_id]['creator']['username']),
+                                                         bd['games'][group_chat_id].creator_username),
                                          parse_mode=HTML)
         else:
             context.bot.send_message(chat_id=group_chat_id,
@@ -294,7 +320,7 @@ def leave(update, context):
         current_game = __get_current_game(context)
         user_id = __get_user_id(update)
 
-        if current_game['participants'].get(user_id):
+        if current_game.participants.get(user_id):
             __remove_user_from_game(update, context)
             context.bot.send_message(chat_id=group_chat_id,
                                      text=get_string(__get_chat_lang(context), 'game_left',
@@ -304,13 +330,13 @@ def leave(update, context):
                         f" {__get_group_name(update)} - {__get_chat_id(update)}")
 
             usernames = ""
-            for user_id in current_game['participants']:
-                usernames += current_game['participants'][user_id]['username'] + ", "
+            for user_id in current_game.participants:
+                usernames += current_game.participants[user_id].username + ", "
             usernames = f"<b>{usernames[:-2]}</b>"
             context.bot.edit_message_text(chat_id=group_chat_id,
-                                          message_id=current_game['newgame_message']['message_id'],
+                                          message_id=current_game.newgame_message_id,
                                           text=get_string(__get_chat_lang(context), 'game_created',
-                                                          current_game['creator']['username'],
+                                                          current_game.creator_username,
                                                           cd['timers']['durations']['newgame'], usernames),
                                           parse_mode=HTML)
 
@@ -325,7 +351,7 @@ def leave(update, context):
                                  text=get_string(__get_chat_lang(context), msg='no_game_yet'))
 
 
-def start_game(update, context, timer: bool = False):
+def start_game(update, context):
     __check_bot_data_is_initialized(context)
 
     cd = context.chat_data
@@ -345,63 +371,103 @@ def start_game(update, context, timer: bool = False):
                                  text=get_string(__get_chat_lang(context), 'no_game_yet'))
         return
 
-    if len(current_game['participants']) == 0:
+    if len(current_game.participants) == 0:
         context.bot.send_message(chat_id=group_chat_id,
                                  text=get_string(__get_chat_lang(context), 'no_participants'))
         return
 
-    if not timer:
-        if __forbid_not_game_creator(update, context, group_chat_id, command="/startgame"):
-            return
-        else:
-            if bd['games'].get(group_chat_id):
-                context.bot.send_message(chat_id=group_chat_id,
-                                         text=get_string(__get_chat_lang(context), 'game_already_started'))
-                return
-            cd['timers']['newgame'] = None
-            timers['newgame'][group_chat_id]()  # cancel timer if started by game creator
+    if __forbid_not_game_creator(update, context, group_chat_id, command="/startgame"):
+        return
 
-    table_list = get_shuffled_dice(cd['settings']['lang'], cd['settings']['table_dimensions'])
-    table_str = __get_formatted_table(table_list)
+    if bd['games'].get(group_chat_id):
+        context.bot.send_message(chat_id=group_chat_id,
+                                 text=get_string(__get_chat_lang(context), 'game_already_started'))
+        return
 
-    row_col_num = int(sqrt(len(table_list)))
-    table_list = [letter if letter != "Qu" else "Q" for letter in table_list]
-    table_grid = {(row, col): table_list[row * row_col_num + col].lower()
-                  for row in range(row_col_num) for col in range(row_col_num)}
+    cd['timers']['newgame'] = None
+    __cancel_timer(context, 'newgame', group_chat_id)
 
-    bd['games'][group_chat_id] = current_game
-    bd['games'][group_chat_id]['table_str'] = table_str
-    bd['games'][group_chat_id]['table_grid'] = table_grid
+    logger.info(f"User {__get_user_for_log(update)} started a game in group"
+                f" {__get_group_name(update)} - {__get_chat_id(update)}")
+    __start_game(context, group_chat_id)
+
+
+def __start_game(context, group_chat_id: int):
+    cd = context.chat_data
+    bd = context.bot_data
+    bd['games'][group_chat_id] = __get_current_game(context)
 
     context.bot.send_message(chat_id=group_chat_id,
                              text=get_string(__get_chat_lang(context), 'game_started_group'))
-    logger.info(f"User {__get_user_for_log(update)} started a game in group"
-                f" {__get_group_name(update)} - {__get_chat_id(update)}")
+
+    board = pop_board(cd['settings']['lang'], cd['settings']['table_dimensions'])
+    if board:
+        __deal_board(context, group_chat_id, board)
+        return
+
+    # the pool is empty: the board is rolled and scored in another process, and the players will receive it as soon
+    # as it's ready
+    future = submit_board(cd['settings']['lang'], cd['settings']['table_dimensions'])
+    pending_boards[group_chat_id] = future  # the game can be killed while its board is being generated
+    future.add_done_callback(lambda f: context.dispatcher.run_async(__deal_generated_board, context,
+                                                                    group_chat_id, f))
+
+
+def __deal_generated_board(context, group_chat_id: int, future):
+    with __get_chat_lock(group_chat_id):
+        __deal_board_of_future(context, group_chat_id, future)
+
+
+def __deal_board_of_future(context, group_chat_id: int, future):
+    cd = context.chat_data
+    if pending_boards.get(group_chat_id) is future:
+        del pending_boards[group_chat_id]
+    if future.cancelled() or not context.bot_data['games'].get(group_chat_id):
+        return  # the game has been killed while its board was being generated
+
+    try:
+        board = future.result()
+    except Exception:
+        logger.exception(f"Could not generate a board in a worker process for group {group_chat_id}")
+        board = generate_board(cd['settings']['lang'], cd['settings']['table_dimensions'])
+    __deal_board(context, group_chat_id, board)
+
+
+def __deal_board(context, group_chat_id: int, board: dict):
+    cd = context.chat_data
+    bd = context.bot_data
+    current_game = bd['games'][group_chat_id]
+
+    table_str = board['table_str']
+    current_game.table_str = table_str
+    __forget_formatted_words(group_chat_id)
+    current_game.table_grid = board['table_grid']
+    # all the words of the dictionary which can be found on this table, so that validating a word is a set lookup
+    current_game.board_words = board['words']
 
     text = get_string(__get_game_lang(context, group_chat_id), 'game_started_private',
                       cd['timers']['durations']['ingame']) + "\n\n\n" + table_str
     kill_game = False
-    for player in current_game['participants']:
-        try:
-            context.bot.send_message(chat_id=player,
-                                     text=text,
-                                     parse_mode=HTML)
-        except Unauthorized:
+    # all the players receive the board at the same time, so that nobody has a head start
+    errors = send_messages(context.bot, list(current_game.participants), text,
+                           description=f"boards in group {group_chat_id}", parse_mode=HTML)
+    for player, error in errors.items():
+        if isinstance(error, Unauthorized):
             context.bot.send_message(chat_id=group_chat_id,
                                      text=get_string(__get_chat_lang(context), 'game_killed_user_did_not_start_the_bot',
-                                                     current_game['participants'][player]['username']),
+                                                     current_game.participants[player].username),
                                      parse_mode=HTML)
             kill_game = True
+        else:
+            logger.error(f"Could not send the board to user {player} in group {group_chat_id}: {error}")
 
     if kill_game:
-        kill(update, context, bot_not_started=True)
+        kill(None, context, bot_not_started=True, group_id=group_chat_id)
         return
 
-    t = Timer(interval=cd['timers']['durations']['ingame'],
-              function=__ingame_timer, args=(update, context, group_chat_id))
-    t.start()
-    bd['games'][group_chat_id]['ingame_timer'] = t.name
-    timers['ingame'][group_chat_id] = t.cancel
+    current_game.ingame_timer = time() + cd['timers']['durations']['ingame']
+    __schedule_timer(context, 'ingame', group_chat_id, current_game.ingame_timer)
+    __notify_running_game(group_chat_id, True)
 
 
 def points_handler(update, context):
@@ -411,20 +477,11 @@ def points_handler(update, context):
     user_id = __get_user_id(update)
     bd = context.bot_data
 
-    not_finished = {}
-    for game in bd['games']:
-        if not bd['games'][game]['is_finished']:
-            not_finished[game] = bd['games'][game]
-
-    for group in not_finished:
-        participants = bd['games'][group]['participants']
-        for participant in participants:
-            if user_id == participant:
-                group_id = group
-                break
-        else:
-            continue
-        break
+    for group in bd['user_games'].get(user_id, []):
+        game = bd['games'].get(group)
+        if game and game.table_grid and not game.is_finished and user_id in game.participants:
+            group_id = group
+            break
     else:
         context.bot.send_message(chat_id=chat_id,
                                  text=get_string(__get_chat_lang(context), 'received_dm_but_user_not_in_game'))
@@ -432,51 +489,65 @@ def points_handler(update, context):
 
     word = update.message.text.lower()
 
+    # the game is only read until the group is locked below, since it can be ended, killed or left meanwhile
     for char in word:
-        if char not in letters_sets[bd['games'][group_id]['lang']]:
-            update.message.reply_text(get_string(__get_game_lang(context, group_id), 'received_dm_but_char_not_alpha'))
-            update.message.reply_text(text=bd['games'][group_id]['table_str'],
+        if char not in letters_sets[game.lang]:
+            update.message.reply_text(get_string(game.lang, 'received_dm_but_char_not_alpha'))
+            update.message.reply_text(text=game.table_str,
                                       parse_mode=HTML)
             return
 
-    game = bd['games'][group_id]
-
-    if (len(word) < 3 and game['dim'] == "4x4") \
-            or (len(word) < 4 and game['dim'] == "5x5"):
-        update.message.reply_text(get_string(__get_game_lang(context, group_id), 'received_dm_but_word_too_short'))
-        update.message.reply_text(text=game['table_str'],
+    if (len(word) < 3 and game.dim == "4x4") \
+            or (len(word) < 4 and game.dim == "5x5"):
+        update.message.reply_text(get_string(game.lang, 'received_dm_but_word_too_short'))
+        update.message.reply_text(text=game.table_str,
                                   parse_mode=HTML)
         return
 
     if "q" in word and "qu" not in word:
-        update.message.reply_text(get_string(__get_game_lang(context, group_id), 'received_dm_but_q_without_u'))
-        update.message.reply_text(text=game['table_str'],
+        update.message.reply_text(get_string(game.lang, 'received_dm_but_q_without_u'))
+        update.message.reply_text(text=game.table_str,
                                   parse_mode=HTML)
         return
 
     word = word.replace("qu", "q")
 
-    if not __validate_word_by_boggle_rules(word, game['table_grid']):
-        update.message.reply_text(get_string(__get_game_lang(context, group_id), 'received_dm_but_word_not_validated'))
-        update.message.reply_text(text=game['table_str'],
+    if not __validate_word_by_boggle_rules(word, game):
+        update.message.reply_text(get_string(game.lang, 'received_dm_but_word_not_validated'))
+        update.message.reply_text(text=game.table_str,
+                                  parse_mode=HTML)
+        return
+
+    if not __validate_word_by_dictionary(word, game):
+        update.message.reply_text(get_string(game.lang,
+                                             'received_dm_but_word_not_in_dictionary', word.replace("q", "qu")))
+        update.message.reply_text(text=game.table_str,
                                   parse_mode=HTML)
         return
 
     word = word.replace("q", "qu")
-    words = bd['games'][group_id]['participants'][user_id]['words']
 
-    if not words.get(word):
-        words[word] = {
-            'points': __get_points_for_word(word, game['dim']),
-            'sent_by_other_players': False,
-            'deleted': False
-        }
-        update.message.reply_text(text=game['table_str'],
+    # the word is added while the group is locked, so that the game can't end meanwhile
+    with __get_chat_lock(group_id):
+        participant = game.participants.get(user_id)
+        if game.is_finished or bd['games'].get(group_id) is not game or participant is None:
+            # the game has ended or has been killed, or the player has left or has been kicked
+            context.bot.send_message(chat_id=chat_id,
+                                     text=get_string(__get_chat_lang(context), 'received_dm_but_user_not_in_game'))
+            return
+        words = participant.words
+        is_new_word = not words.get(word)
+        if is_new_word:
+            words[word] = WordEntry(get_points_for_word(word, game.dim))
+            __forget_formatted_words(group_id, user_id)
+
+    if is_new_word:
+        update.message.reply_text(text=game.table_str,
                                   parse_mode=HTML)
     else:
-        update.message.reply_text(get_string(__get_game_lang(context, group_id), 'received_dm_but_word_already_sent',
+        update.message.reply_text(get_string(game.lang, 'received_dm_but_word_already_sent',
                                              word))
-        update.message.reply_text(text=game['table_str'],
+        update.message.reply_text(text=game.table_str,
                                   parse_mode=HTML)
 
 
@@ -502,9 +573,9 @@ def delete(update, context):
         return
 
     game = bd['games'][group_id]
-    lang = game['lang']
+    lang = game.lang
 
-    if not game['is_finished']:
+    if not game.is_finished:
         context.bot.send_message(chat_id=group_id,
                                  text=get_string(lang, msg='game_not_yet_finished'))
         return
@@ -524,14 +595,18 @@ def delete(update, context):
                 return
 
     not_found = words
-    players = game['participants']
+    players = game.participants
+    changed_players = set()  # only their words are formatted again
     for user_id in players:
-        player_words = [w for w in players[user_id]['words']]
+        player_words = [w for w in players[user_id].words]
         for player_word in player_words:
             for word in words:
                 if player_word == word:
-                    players[user_id]['words'][player_word]['deleted'] = True
+                    players[user_id].words[player_word].deleted = True
+                    changed_players.add(user_id)
                     not_found.remove(word)
+    for user_id in changed_players:
+        __forget_formatted_words(group_id, user_id)
 
     if len(not_found) > 0:
         context.bot.send_message(chat_id=group_id,
@@ -539,16 +614,16 @@ def delete(update, context):
     else:
         # player_words_without_points = __get_formatted_words(context, group_id, with_points=False)
         player_words_without_points = {}
-        for user_id in game['participants']:
-            player_words_without_points[user_id] = __get_formatted_words(context, group_id,
-                                                                         with_points=False, user_id=user_id)
-            try:
-                context.bot.edit_message_text(chat_id=group_id,
-                                              message_id=game['participants'][user_id]['result_message_id'],
-                                              text=player_words_without_points[user_id],
-                                              parse_mode=HTML)
-            except BadRequest:  # message is not modified because it doesn't contain any of the deleted words
-                pass
+        for user_id in game.participants:
+            message_id = game.participants[user_id].result_message_id
+            player_words_without_points[message_id] = __get_formatted_words(context, group_id,
+                                                                            with_points=False, user_id=user_id)
+        errors = edit_messages(context.bot, group_id, player_words_without_points,
+                               description=f"deleted words in group {group_id}", parse_mode=HTML)
+        for message_id, error in errors.items():
+            # a message is not modified if it doesn't contain any of the deleted words
+            if not isinstance(error, BadRequest):
+                logger.error(f"Could not edit the words of message {message_id} in group {group_id}: {error}")
 
         context.bot.send_message(chat_id=group_id,
                                  text=get_string(lang, 'all_words_deleted'),
@@ -575,9 +650,9 @@ def isthere(update, context):
         return
 
     game = bd['games'][group_id]
-    lang = game['lang']
+    lang = game.lang
 
-    if not game['is_finished']:
+    if not game.is_finished:
         context.bot.send_message(chat_id=group_id,
                                  text=get_string(lang, msg='game_not_yet_finished'))
         return
@@ -597,9 +672,9 @@ def isthere(update, context):
                 return
 
     played = []
-    players = game['participants']
+    players = game.participants
     for user_id in players:
-        player_words = [w for w in players[user_id]['words']]
+        player_words = [w for w in players[user_id].words]
         for player_word in player_words:
             for word in words:
                 if player_word == word:
@@ -635,100 +710,64 @@ def end_game(update, context):
         return
 
     game = bd['games'][group_id]
-    lang = game['lang']
+    lang = game.lang
 
     if __forbid_not_game_creator(update, context, group_id, command="/endgame", allow_admins=True):
         return
 
-    if not game['is_finished']:
+    if not game.is_finished:
         context.bot.send_message(chat_id=group_id,
                                  text=get_string(lang, msg='game_not_yet_finished'))
         return
 
-    us = bd['stats']['users']
     gs = bd['stats']['groups']
 
-    total_points = 0
-    players_points = {}
-    players = game['participants']
-    for user_id in players:  # stats already initialized in join()
-        words = players[user_id]['words']
-        for word in words:
-            if not words[word]['sent_by_other_players'] and not words[word]['deleted']:
-                if not players_points.get(user_id):
-                    players_points[user_id] = words[word]['points']
-                else:
-                    players_points[user_id] += words[word]['points']
-                total_points += words[word]['points']
-        if not players_points.get(user_id):  # hasn't made any points
-            players_points[user_id] = 0
-
-    max_points = -1
-    for user_id in players_points:
-        points = players_points[user_id]
-        max_points = points if points > max_points else max_points
+    players = game.participants
+    players_points = game.get_scores()
+    total_points = sum(players_points.values())
+    max_points = max(players_points.values(), default=-1)
 
     winners = {}
     for user_id in players_points:
         if players_points[user_id] == max_points:
-            winners[user_id] = game['participants'][user_id]['username']
-    game['winners'] = winners
+            winners[user_id] = game.participants[user_id].username
+    game.winners = winners
+    game.scores = players_points
+    rankings.add_game(group_id, game)
 
     # update group stats
     if not gs.get(group_id):
-        gs[group_id] = {
-            'matches': 0,
-            'points': 0,
-            'average': 0
-        }
-    gs[group_id]['points'] += total_points
-    gs[group_id]['matches'] += 1
-    gs[group_id]['average'] = int(gs[group_id]['points'] / gs[group_id]['matches'])
-
-    # update users stats
-    for user_id in players:
-        us[user_id]['matches']['played'] += 1
-        if winners.get(user_id) and len(winners) == 1:  # won
-            us[user_id]['matches']['won']['value'] += 1
-            us[user_id]['matches']['latest']['won'] = "won"
-        elif winners.get(user_id) and len(winners) > 1:  # even
-            us[user_id]['matches']['even']['value'] += 1
-            us[user_id]['matches']['latest']['won'] = "even"
-        elif not winners.get(user_id):  # lost
-            us[user_id]['matches']['lost']['value'] += 1
-            us[user_id]['matches']['latest']['won'] = "lost"
-        for ending in ['won', 'even', 'lost']:
-            us[user_id]['matches'][ending]['percentage'] = round(us[user_id]['matches'][ending]['value']
-                                                                 / us[user_id]['matches']['played'] * 100, 2)
-        us[user_id]['points']['max'] = players_points[user_id] if players_points[user_id] > us[user_id]['points']['max'] \
-            else us[user_id]['points']['max']
-        us[user_id]['points']['min'] = players_points[user_id] if players_points[user_id] < us[user_id]['points']['max'] \
-            else us[user_id]['points']['min']
-        us[user_id]['points']['total'] += players_points[user_id]
-        us[user_id]['points']['average'] = round(us[user_id]['points']['total'] / us[user_id]['matches']['played'], 2)
-        us[user_id]['matches']['latest']['points'] = players_points[user_id]
-        to_delete = []
-        for word in us[user_id]['matches']['latest']['words']:
-            to_delete.append(word)
-        for word in to_delete:
-            del us[user_id]['matches']['latest']['words'][word]
-        for word in game['participants'][user_id]['words']:
-            us[user_id]['matches']['latest']['words'][word] = game['participants'][user_id]['words'][word]['points']
-
-    for user_id in game['participants']:
-        try:
-            context.bot.edit_message_text(chat_id=group_id,
-                                          message_id=game['participants'][user_id]['result_message_id'],
-                                          text=__get_formatted_words(context, group_id, with_points=True, only_valid=True,
-                                                                     user_id=user_id),
-                                          parse_mode=HTML)
-        except BadRequest:
-            pass
+        gs[group_id] = GroupStats()
+    gs[group_id].add_game(total_points)
+
+    # update users stats, already initialized in join(), both overall and in the group
+    group_users = bd['stats']['group_users'].setdefault(group_id, {})
+    for user_id, (result, points, words) in __get_game_results(game).items():
+        add_user_results(bd, user_id, players[user_id].username, result, points, words)
+        for listener in user_results_listeners:
+            listener(user_id, players[user_id].username, result, points, words)
+        if user_id not in group_users:
+            group_users[user_id] = UserStats(players[user_id].username)
+        group_users[user_id].add_game(result, points, words)
+        leaderboards.update(group_id, user_id, group_users[user_id])
 
-    chat_game = __get_latest_game(context)
-    cd['games'].remove(chat_game)
-    cd['games'].append(game)
+    player_words_with_points = {}
+    for user_id in game.participants:
+        player_words_with_points[game.participants[user_id].result_message_id] = \
+            __get_formatted_words(context, group_id, with_points=True, only_valid=True, user_id=user_id)
+    errors = edit_messages(context.bot, group_id, player_words_with_points,
+                           description=f"results in group {group_id}", parse_mode=HTML)
+    for message_id, error in errors.items():
+        if not isinstance(error, BadRequest):
+            logger.error(f"Could not edit the results of message {message_id} in group {group_id}: {error}")
+
+    cd['games'][-1] = game  # the game in bot_data has the results
+    archive_old_games(group_id, cd)
     del bd['games'][group_id]
+    __notify_running_game(group_id, False)
+    __forget_formatted_words(group_id)
+    for user_id in players:
+        __unindex_user_game(context, user_id, group_id)
 
     lang = __get_chat_lang(context)
     winner_str = ""
@@ -743,7 +782,7 @@ def end_game(update, context):
     players_points = {k: v for k, v in sorted(players_points.items(), key=lambda item: item[1], reverse=True)}
     for user_id in players_points:
         if user_id not in winners:
-            text += f"<i>{game['participants'][user_id]['username']}: {players_points[user_id]}</i>\n"
+            text += f"<i>{game.participants[user_id].username}: {players_points[user_id]}</i>\n"
 
     context.bot.send_message(chat_id=group_id,
                              text=text,
@@ -774,37 +813,22 @@ def last(update, context):
     last_n = int(last_n[0])
     cd = context.chat_data
 
-    tot_n_games = len(cd['games'])
+    # the scores of the games which have ended are summed once, the older games are read from the archive only the
+    # first time
+    tot_n_games, players_points = rankings.get_ranking(
+        group_id, last_n, lambda: [game for game in load_games(group_id) + cd['games'] if game.scores is not None])
     if tot_n_games < last_n:
         msg = get_string(lang, 'not_enough_games_for_last_command', last_n, tot_n_games)
         last_n = tot_n_games
     else:
         msg = get_string(lang, 'last_n_games_ranking', last_n)
 
-    last_n_games = cd['games'][-last_n:]
-    players_points = {}
-    players_usernames = {}
-    for game in last_n_games:
-        for player in game['participants']:
-            game_score = 0
-            words = game['participants'][player]['words']
-            for word in words:
-                game_score += words[word]['points'] \
-                    if not words[word]['deleted'] and not words[word]['sent_by_other_players'] else 0
-            if player in players_points:
-                players_points[player] += game_score
-            else:
-                players_points[player] = game_score
-                username = game['participants'][player]['username']
-                if '<a href="tg://user?id=' not in username:  # not saved as mention_html
-                    username = mention_html(player, username)
-                players_usernames[player] = username
-
-    players_points = {k: v for k, v in sorted(players_points.items(), key=lambda item: item[1], reverse=True)}
-
-    ranking = "\n".join([f"<code>#{i+1}</code> <b>{players_usernames[p]}</b>: "
-                         f"<code>{players_points[p]}</code>"
-                         for i, p in enumerate(players_points)])
+    ranking = []
+    for i, (user_id, username, points) in enumerate(players_points):
+        if '<a href="tg://user?id=' not in username:  # not saved as mention_html
+            username = mention_html(user_id, username)
+        ranking.append(f"<code>#{i+1}</code> <b>{username}</b>: <code>{points}</code>")
+    ranking = "\n".join(ranking)
 
     context.bot.send_message(chat_id=group_id,
                              text=f"{msg}\n{ranking}",
@@ -837,21 +861,21 @@ def kick(update, context):
         return
 
     game = bd['games'][group_id]
-    lang = game['lang']
+    lang = game.lang
 
     if __forbid_not_game_creator(update, context, group_id, command="/kick"):
         return
 
-    if game['is_finished']:
+    if game.is_finished:
         context.bot.send_message(chat_id=group_id,
-                                 text=get_string(lang, 'game_already_finished_kick', game['creator']['username']),
+                                 text=get_string(lang, 'game_already_finished_kick', game.creator_username),
                                  parse_mode=HTML)
         return
 
     reply_keyboard = [[]]
-    for user_id in game['participants']:
-        if user_id != game['creator']['id']:
-            button = InlineKeyboardButton(game['participants'][user_id]['username'],
+    for user_id in game.participants:
+        if user_id != game.creator_id:
+            button = InlineKeyboardButton(game.participants[user_id].username,
                                           callback_data=f"kick_{user_id}_from_{group_id}")
             if len(reply_keyboard[-1]) == 2:
                 reply_keyboard.append([button])
@@ -866,7 +890,7 @@ def kick(update, context):
         return
 
     context.bot.send_message(chat_id=group_id,
-                             text=get_string(lang, 'kick_user_choice_group', game['creator']['username']),
+                             text=get_string(lang, 'kick_user_choice_group', game.creator_username),
                              reply_markup=reply_markup,
                              parse_mode=HTML)
 
@@ -877,11 +901,12 @@ def kill(update, context, bot_not_started: bool = False, bot_restarted: bool = F
     if bot_not_started or bot_restarted:
         bd = context.bot_data
         cd = context.chat_data
-        if bot_not_started:
-            group_id = __get_chat_id(update)
+        for user_id in bd['games'][group_id].participants:
+            __unindex_user_game(context, user_id, group_id)
         del bd['games'][group_id]
-        latest_game = __get_latest_game(context)
-        cd['games'].remove(latest_game)
+        __notify_running_game(group_id, False)
+        __forget_formatted_words(group_id)
+        cd['games'].pop()  # the latest game
         return
 
     if not __check_chat_is_group(update):
@@ -908,14 +933,14 @@ def kill(update, context, bot_not_started: bool = False, bot_restarted: bool = F
     else:
         game = current_game
         delete_from_bd = False
-    lang = game['lang']
+    lang = game.lang
 
     if __forbid_not_game_creator(update, context, group_id, command="/kill"):
         return
 
-    if game['is_finished']:
+    if game.is_finished:
         context.bot.send_message(chat_id=group_id,
-                                 text=get_string(lang, 'game_already_finished_kill', game['creator']['username']),
+                                 text=get_string(lang, 'game_already_finished_kill', game.creator_username),
                                  parse_mode=HTML)
         return
 
@@ -924,21 +949,23 @@ def kill(update, context, bot_not_started: bool = False, bot_restarted: bool = F
     logger.info(f"User {__get_user_for_log(update)} killed a game in group"
                 f" {__get_group_name(update)} - {__get_chat_id(update)}")
 
-    for user_id in game['participants']:
+    for user_id in game.participants:
         context.bot.send_message(chat_id=user_id,
-                                 text=get_string(lang, 'game_killed_private', game['creator']['username']),
+                                 text=get_string(lang, 'game_killed_private', game.creator_username),
                                  parse_mode=HTML)
+        __unindex_user_game(context, user_id, group_id)
 
     if delete_from_bd:
         del bd['games'][group_id]
-        timers['ingame'][group_id]()
-        timers['ingame'][group_id] = None
+        __notify_running_game(group_id, False)
+        __forget_formatted_words(group_id)
+        __cancel_timer(context, 'ingame', group_id)
+        if group_id in pending_boards:
+            pending_boards.pop(group_id).cancel()
     else:
         cd['timers']['newgame'] = None
-        timers['newgame'][group_id]()
-        timers['newgame'][group_id] = None
-    latest_game = __get_latest_game(context)
-    cd['games'].remove(latest_game)
+        __cancel_timer(context, 'newgame', group_id)
+    cd['games'].pop()  # the latest game
 
 
 def show_statistics(update, context):
@@ -965,6 +992,41 @@ def show_statistics(update, context):
         logger.info(f"User {__get_user_for_log(update)} asked for his stats in a private chat")
 
 
+def top(update, context):
+    __check_bot_data_is_initialized(context)
+    __check_bot_was_restarted(update, context)
+
+    lang = __get_chat_lang(context)
+    chat_id = __get_chat_id(update)
+    metric = update.message.text.lower().split()[1:]  # skip /top
+    if len(metric) > 1 or (metric and metric[0] not in leaderboards.metrics):
+        context.bot.send_message(chat_id=chat_id,
+                                 text=get_string(lang, 'wrong_format_after_top_command'))
+        return
+    metric = metric[0] if metric else 'points'
+
+    # the leaderboard of the group in a group, the one of all the players of the bot in a private chat
+    if __check_chat_is_group(update):
+        scope = chat_id
+        all_stats = context.bot_data['stats']['group_users'].get(chat_id, {})
+    else:
+        scope = None
+        all_stats = context.bot_data['stats']['users']
+    ranking = leaderboards.get_top(scope, metric, all_stats)
+
+    if not ranking:
+        text = get_string(lang, 'no_players_for_top_command')
+    else:
+        unit = "%" if metric == 'wins' else ""
+        text = get_string(lang, f'top_{metric}') + "\n" + \
+            "\n".join(f"<code>#{i + 1}</code> <b>{all_stats[user_id].username}</b>: <code>{value}{unit}</code>"
+                      for i, (user_id, value) in enumerate(ranking))
+    context.bot.send_message(chat_id=chat_id,
+                             text=text,
+                             parse_mode=HTML)
+    logger.info(f"User {__get_user_for_log(update)} asked for the leaderboard by {metric} in chat {chat_id}")
+
+
 def settings(update, context):
     __check_bot_data_is_initialized(context)
     __check_bot_was_restarted(update, context)
@@ -1068,9 +1130,9 @@ def query_handler(update, context):
         group_id_to_kick_from = int(query.data.split("_from_")[1])
         game = bd['games'][group_id_to_kick_from]
 
-        if user_id != game['creator']['id']:
+        if user_id != game.creator_id:
             context.bot.send_message(chat_id=group_id_to_kick_from,
-                                     text=get_string(game['lang'], 'forbid_kick_to_not_game_creator'))
+                                     text=get_string(game.lang, 'forbid_kick_to_not_game_creator'))
             return
 
         lang = __get_game_lang(context, group_id_to_kick_from)
@@ -1079,19 +1141,21 @@ def query_handler(update, context):
                                       message_id=query.message.message_id,
                                       text=get_string(lang,
                                                       'kick_user_successful',
-                                                      game['participants'][user_id_to_kick]['username']))
+                                                      game.participants[user_id_to_kick].username))
         logger.info(f"User {__get_user_for_log_from_query(query)} kicked "
-                    f"{game['participants'][user_id_to_kick]['username']} from a game in group"
+                    f"{game.participants[user_id_to_kick].username} from a game in group"
                     f" {__get_group_name_from_query(query)} - {__get_chat_id_from_query(query)}")
 
         try:
             context.bot.send_message(chat_id=user_id_to_kick,
-                                     text=get_string(lang, 'you_have_been_kicked', game['creator']['username']),
+                                     text=get_string(lang, 'you_have_been_kicked', game.creator_username),
                                      parse_mode=HTML)
         except Unauthorized:
             pass
 
-        del game['participants'][user_id_to_kick]
+        del game.participants[user_id_to_kick]
+        __unindex_user_game(context, user_id_to_kick, group_id_to_kick_from)
+        __forget_formatted_words(group_id_to_kick_from, user_id_to_kick)
 
     elif query.data.startswith("settings"):
         setting = query.data.split("_")[1]
@@ -1115,11 +1179,11 @@ def query_handler(update, context):
             if setting == "english":
                 cd['settings']['lang'] = 'eng'
                 if __get_current_game(context):
-                    cd['games'][-1]['lang'] = 'eng'
+                    cd['games'][-1].lang = 'eng'
             elif setting == "italiano":
                 cd['settings']['lang'] = 'ita'
                 if __get_current_game(context):
-                    cd['games'][-1]['lang'] = 'ita'
+                    cd['games'][-1].lang = 'ita'
             context.bot.edit_message_text(chat_id=query.message.chat_id,
                                           message_id=query.message.message_id,
                                           text=get_string(__get_chat_lang(context), 'settings_language_changed'))
@@ -1409,6 +1473,30 @@ def query_handler(update, context):
                             f" {__get_group_name_from_query(query)} - {__get_chat_id_from_query(query)}")
 
 
+def start_profiler(update, context):
+    # only the developer can profile the bot, the command is ignored in any other chat
+    chat_id = __get_chat_id(update)
+    if str(chat_id) != str(castes_chat_id):
+        return
+    args = update.message.text.split()[1:]
+    duration = min(int(args[0]), max_profile_duration) if args and args[0].isdigit() else 30
+    update.message.reply_text(f"Sampling the stacks of all the threads for {duration} seconds.")
+    # the profile runs in its own thread, so that it doesn't keep a dispatcher worker busy
+    Thread(target=__send_profile, args=(context.bot, chat_id, duration), name="profiler", daemon=True).start()
+
+
+def __send_profile(bot, chat_id: int, duration: int):
+    stacks = profile(duration)
+    if stacks is None:
+        bot.send_message(chat_id=chat_id, text="Another profile is running.")
+        return
+    bot.send_document(chat_id=chat_id,
+                      document=BytesIO(stacks.encode()),
+                      filename=f"profile_{int(time())}.collapsed",
+                      caption="Collapsed stacks, open with speedscope or flamegraph.pl")
+    logger.info(f"Sent a profile of {duration} seconds to the developer")
+
+
 def error(update, context):
     """Log Errors caused by Updates."""
     if update:
@@ -1455,7 +1543,7 @@ def __get_chat_lang(context) -> str:
 
 def __get_game_lang(context, group_id: int) -> str:
     bd = context.bot_data
-    return bd['games'][group_id]['lang']
+    return bd['games'][group_id].lang
 
 
 # return True for GROUP or SUPERGROUP, False for PRIVATE (or CHANNEL)
@@ -1471,55 +1559,77 @@ def __get_user_id(update) -> int:
     return update.message.from_user.id
 
 
-def __newgame_timer(update, context):
+def __newgame_timer(context):
+    group_id, deadline = context.job.context
+    with __get_chat_lock(group_id):
+        __end_pregame(__get_chat_context(context, group_id), group_id, deadline)
+
+
+def __end_pregame(context, group_id: int, deadline: float):
     cd = context.chat_data
+    # the job is removed from the job queue as it's run, so it can't be canceled anymore if the game is started or
+    # killed while it's waiting for the lock of the group
+    if cd['timers']['newgame'] != deadline or context.bot_data['games'].get(group_id):
+        return
     current_game = __get_current_game(context)
     cd['timers']['newgame'] = None
-    if len(current_game['participants']) == 0:
-        context.bot.send_message(chat_id=__get_chat_id(update),
+    if current_game is None:
+        return
+    if len(current_game.participants) == 0:
+        context.bot.send_message(chat_id=group_id,
                                  text=get_string(__get_chat_lang(context), 'newgame_timer_expired'))
-        cd['games'].remove(current_game)
+        cd['games'].pop()  # the current game
     else:
-        start_game(update, context, timer=True)
+        logger.info(f"The pregame timer started a game in group {group_id}")
+        __start_game(context, group_id)
+
+
+def __ingame_timer(context):
+    group_id, deadline = context.job.context
+    with __get_chat_lock(group_id):
+        __end_ingame(__get_chat_context(context, group_id), group_id, deadline)
 
 
-def __ingame_timer(update, context, group_id: int):
-    if not context.bot_data['games'].get(group_id):
-        return  # the game has been canceled because a user hasn't started the bot
-    game = context.bot_data['games'][group_id]
-    game['ingame_timer'] = None
-    game['is_finished'] = True
+def __end_ingame(context, group_id: int, deadline: float):
+    game = context.bot_data['games'].get(group_id)
+    if not game or game.ingame_timer != deadline:
+        return  # the game has been killed, or it's another game of the group
+    game.ingame_timer = None
+    game.is_finished = True
     __check_words_in_common(context, group_id)
     player_words_with_points = {}
-    for user_id in game['participants']:
+    for user_id in game.participants:
         player_words_with_points[user_id] = __get_formatted_words(context, group_id, with_points=True, user_id=user_id)
     # player_words_without_points = __get_formatted_words(context, group_id, with_points=False)
 
-    for user_id in player_words_with_points:
-        context.bot.send_message(chat_id=user_id,
-                                 text=get_string(__get_game_lang(context, group_id), 'ingame_timer_expired_private',
-                                                 player_words_with_points[user_id]),
-                                 parse_mode=HTML)
+    texts = {user_id: get_string(__get_game_lang(context, group_id), 'ingame_timer_expired_private',
+                                 player_words_with_points[user_id])
+             for user_id in player_words_with_points}
+    errors = send_messages(context.bot, list(texts), texts, description=f"words in group {group_id}", parse_mode=HTML)
+    for user_id, error in errors.items():
+        logger.error(f"Could not send the words to user {user_id} in group {group_id}: {error}")
 
     context.bot.send_message(chat_id=group_id,
                              text=get_string(__get_chat_lang(context), 'ingame_timer_expired_group',
-                                             game['creator']['username'], game['creator']['username']),
+                                             game.creator_username, game.creator_username),
                              # .replace("<", "&lt;").replace(">", "&gt;").replace("'", "&#39;"),
                              parse_mode=HTML)
 
     player_words_without_points = {}
-    for user_id in game['participants']:
+    for user_id in game.participants:
         player_words_without_points[user_id] = __get_formatted_words(context, group_id,
                                                                      with_points=False, user_id=user_id)
         message = context.bot.send_message(chat_id=group_id,
                                            text=player_words_without_points[user_id],
                                            parse_mode=HTML)
-        game['participants'][user_id]['result_message_id'] = message['message_id']
+        game.participants[user_id].result_message_id = message['message_id']
 
 
 def __check_bot_data_is_initialized(context):
     if not context.bot_data.get('stats'):
         __init_bot_data(context)
+    if 'user_games' not in context.bot_data:
+        __init_user_games_index(context)
 
 
 def __init_bot_data(context):
@@ -1527,8 +1637,69 @@ def __init_bot_data(context):
     bd['games'] = {}
     bd['stats'] = {
         'users': {},
-        'groups': {}
+        'groups': {},
+        'group_users': {}
     }
+    bd['user_games'] = {}
+
+
+def __init_user_games_index(context):
+    # user_id -> ids of the groups where the user has joined a game, so that a word sent in a private chat can be
+    # routed to its game without looking into every game
+    bd = context.bot_data
+    bd['user_games'] = {}
+    for group_id in bd['games']:
+        for user_id in bd['games'][group_id].participants:
+            __index_user_game(context, user_id, group_id)
+
+
+def __init_group_users_stats(dispatcher):
+    # the statistics of the players in each group are computed once from the games which have ended, archived ones
+    # included, since they were only kept overall before the leaderboards of the groups
+    stats = dispatcher.bot_data['stats']
+    if 'group_users' in stats:
+        return
+    logger.info("Computing the statistics of the players of each group from their games...")
+    stats['group_users'] = {}
+    for group_id, chat_data in dispatcher.chat_data.items():
+        for game in load_games(group_id) + chat_data.get('games', []):
+            if game.winners is None:
+                continue
+            group_users = stats['group_users'].setdefault(group_id, {})
+            for user_id, (result, points, words) in __get_game_results(game).items():
+                if user_id not in group_users:
+                    group_users[user_id] = UserStats(game.participants[user_id].username)
+                group_users[user_id].add_game(result, points, words)
+    dispatcher.update_persistence()  # the statistics of the players of a group are saved with the group
+
+
+def add_user_results(bot_data: dict, user_id: int, username: str, result: str, points: int, words: tuple):
+    """Add the result of a game which has just ended to the overall statistics of one of its players."""
+    users = bot_data['stats']['users']
+    if user_id not in users:
+        users[user_id] = UserStats(username)
+    users[user_id].add_game(result, points, words)
+    leaderboards.update(None, user_id, users[user_id])
+
+
+def __get_game_results(game: Game) -> dict:
+    """Return user_id -> result, points and (word, points) of each word sent for the players of an ended game."""
+    results = {}
+    for user_id, participant in game.participants.items():
+        if user_id not in game.winners:
+            result = "lost"
+        else:
+            result = "won" if len(game.winners) == 1 else "even"
+        results[user_id] = (result, participant.get_points(),
+                            tuple((word, entry.points) for word, entry in participant.words.items()))
+    return results
+
+
+def __convert_table_grids(context):
+    # games started before the grid became a flat string have it as a dict with a (row, col) key for each letter
+    for game in context.bot_data['games'].values():
+        if isinstance(game.table_grid, dict):
+            game.table_grid = "".join(game.table_grid[position] for position in sorted(game.table_grid))
 
 
 def __init_chat_data(context, settings_only: bool = False):
@@ -1561,49 +1732,16 @@ def __init_chat_data(context, settings_only: bool = False):
 
 def __init_group_stats(context, group_id: int):
     bd = context.bot_data
-    bd['stats']['groups'][group_id] = {
-        'matches': 0,
-        'points': 0,
-        'average': 0
-    }
+    bd['stats']['groups'][group_id] = GroupStats()
 
 
 def __init_user_stats(context, user_id: int, username: str, group_id: int, new_player: bool):
     bd = context.bot_data
-    initial_stats = {
-        'username': username,
-        'matches': {
-            'won': {
-                'value': 0,
-                'percentage': 0
-            },
-            'even': {
-                'value': 0,
-                'percentage': 0
-            },
-            'lost': {
-                'value': 0,
-                'percentage': 0
-            },
-            'played': 0,
-            'latest': {
-                'won': "",
-                'points': 0,
-                'words': {}
-            }
-        },
-        'points': {
-            'max': 0,
-            'min': 0,
-            'average': 0,
-            'total': 0
-        }
-    }
     if new_player:
-        bd['stats']['users'][user_id] = initial_stats
+        bd['stats']['users'][user_id] = UserStats(username)
     if not bd['stats']['groups'].get(group_id):
         __init_group_stats(context, group_id)
-    bd['stats']['groups'][group_id][user_id] = initial_stats
+    bd['stats']['groups'][group_id].add_player(user_id)
 
 
 def __join_user_to_game(update, context):
@@ -1611,35 +1749,61 @@ def __join_user_to_game(update, context):
     user_id = __get_user_id(update)
     cd['ingame_user_ids'].append(user_id)
     current_game = __get_current_game(context)
-    current_game['participants'][user_id] = {
-        'username': __get_username(update),
-        'words': {}
-    }
+    current_game.participants[user_id] = Participant(__get_username(update))
+    __index_user_game(context, user_id, __get_chat_id(update))
 
 
 def __remove_user_from_game(update, context):
     cd = context.chat_data
     current_game = __get_current_game(context)
-    participants = current_game['participants']
+    participants = current_game.participants
     user_id = __get_user_id(update)
     cd['ingame_user_ids'].remove(user_id)
     del participants[user_id]
+    __unindex_user_game(context, user_id, __get_chat_id(update))
+
+
+def __index_user_game(context, user_id: int, group_id: int):
+    group_ids = context.bot_data['user_games'].setdefault(user_id, [])
+    if group_id not in group_ids:
+        group_ids.append(group_id)
+        for listener in user_games_listeners:
+            listener(user_id, group_id, True)
 
 
-def __get_latest_game(context) -> dict:
+def __unindex_user_game(context, user_id: int, group_id: int):
+    user_games = context.bot_data['user_games']
+    if group_id in user_games.get(user_id, []):
+        user_games[user_id].remove(group_id)
+        if not user_games[user_id]:
+            del user_games[user_id]
+        for listener in user_games_listeners:
+            listener(user_id, group_id, False)
+
+
+def __notify_running_game(group_id: int, running: bool):
+    for listener in running_games_listeners:
+        listener(group_id, running)
+
+
+def __get_latest_game(context) -> Game:
+    # games are appended to chat_data['games'] when they're created, so the latest game is always the last one
     cd = context.chat_data
-    res = {'unix_epoch': 0}
     if cd.get('games'):
-        for game in cd['games']:
-            res = game if game['unix_epoch'] > res['unix_epoch'] else res
-        return res
-    res['is_finished'] = True
-    return res
+        return cd['games'][-1]
+    return Game(is_finished=True)
+
 
+def __sort_games_by_creation(chat_data: dict):
+    # databases saved before the latest game was kept last could have it anywhere in chat_data['games']
+    for chat_id in chat_data:
+        if chat_data[chat_id].get('games'):
+            chat_data[chat_id]['games'].sort(key=lambda game: game.unix_epoch)
 
-def __get_current_game(context) -> dict:
+
+def __get_current_game(context) -> Game:
     res = __get_latest_game(context)
-    return res if not res['is_finished'] else None
+    return res if not res.is_finished else None
 
 
 def __forbid_not_game_creator(update, context, group_id, command: str, allow_admins: bool = False) -> bool:
@@ -1652,52 +1816,15 @@ def __forbid_not_game_creator(update, context, group_id, command: str, allow_adm
     admin_ids = []
     if allow_admins:
         admin_ids = [adm.user.id for adm in context.bot.get_chat_administrators(group_id)]
-    if user_id != current_game['creator']['id'] and user_id not in admin_ids:
+    if user_id != current_game.creator_id and user_id not in admin_ids:
         context.bot.send_message(chat_id=group_id,
                                  text=get_string(__get_chat_lang(context), 'forbid_not_game_creator',
-                                                 __get_username(update), current_game['creator']['username'], command),
+                                                 __get_username(update), current_game.creator_username, command),
                                  parse_mode=HTML)
         return True
     return False
 
 
-def __get_formatted_table(shuffled_dice: list) -> str:
-    # assuming the table is always an NxN square
-    total_num = len(shuffled_dice)
-    row_col_num = int(sqrt(total_num))
-
-    Qu_is_in_table = "Qu" in shuffled_dice
-
-    formatted_table = ""
-    for i in range(0, total_num, row_col_num):
-        formatted_table += "  |  ".join(shuffled_dice[i:i + row_col_num]) + "\n"
-        if i != total_num - row_col_num:
-            formatted_table += "---|--" * (row_col_num - 1) + "-\n"
-
-    if Qu_is_in_table:
-        lines = formatted_table.splitlines()
-        formatted_table = ""
-        index_u = -1
-        for line in lines:
-            if "Qu" in line:
-                index_u = line.index("u")
-                break
-
-        for line in lines:
-            if "Qu" not in line:
-                formatted_table += line[:index_u]
-                if "-" not in line:
-                    formatted_table += " "
-                else:
-                    formatted_table += "-"
-                formatted_table += line[index_u:]
-            else:
-                formatted_table += line
-            formatted_table += "\n"
-
-    return f"<code>{formatted_table}</code>"
-
-
 def __convert_table_list_to_matrix(table: list) -> list:
     for i, letter in enumerate(table):
         table[i] = letter.lower()
@@ -1709,140 +1836,64 @@ def __convert_table_list_to_matrix(table: list) -> list:
     return res
 
 
-def __validate_word_by_boggle_rules(word: str, grid: dict) -> bool:
-    neighbours = __get_all_grid_neighbours(grid)
-    paths = []
-    full_words = set()
-    full_words.add(word)
-    stems = set(word[:i] for i in range(1, len(word)))
-
-    def __do_search(path):
-        word = __get_path_to_word(grid, path)
-        if word in full_words:
-            paths.append(path)
-        if word not in stems:
-            return
-        for next_pos in neighbours[path[-1]]:
-            if next_pos not in path:
-                __do_search(path + [next_pos])
-
-    for position in grid:
-        __do_search([position])
-
-    words = set()
-    for path in paths:
-        words.add(__get_path_to_word(grid, path))
-
-    return word in words
-
-
-def __get_all_grid_neighbours(grid: dict) -> dict:
-    neighbours = {}
-    for position in grid:
-        position_neighbours = __get_neighbours_of_position(position)
-        neighbours[position] = [p for p in position_neighbours if p in grid]
-    return neighbours
-
-
-def __get_neighbours_of_position(coords: tuple) -> list:
-    row, col = coords
-
-    top_left = (row - 1, col - 1)
-    top_center = (row - 1, col)
-    top_right = (row - 1, col + 1)
-
-    left = (row, col - 1)
-    right = (row, col + 1)
-
-    bottom_left = (row + 1, col - 1)
-    bottom_center = (row + 1, col)
-    bottom_right = (row + 1, col + 1)
-
-    return [top_left, top_center, top_right,
-            left, right,
-            bottom_left, bottom_center, bottom_right]
-
-
-def __get_path_to_word(grid: dict, path: list) -> str:
-    return ''.join([grid[p] for p in path])
+def __validate_word_by_boggle_rules(word: str, game: Game) -> bool:
+    # games created before the board was solved in start_game have no board_words
+    if word in game.board_words:
+        return True
+    return can_trace_word(word, game.table_grid)
 
 
-def __get_points_for_word(word: str, dim: str) -> int:
-    length = len(word)
-    if length < 3:
-        return 0
-    elif length == 3:
-        if dim == "4x4":
-            return 1
-        elif dim == "5x5":
-            return 0
-    elif length == 4:
-        return 1
-    elif length == 5:
-        return 2
-    elif length == 6:
-        return 3
-    elif length == 7:
-        return 5
-    else:
-        return 11
+def __validate_word_by_dictionary(word: str, game: Game) -> bool:
+    if word in game.board_words:
+        return True
+    dictionary = get_dictionary(game.lang)
+    return dictionary is None or word in dictionary
 
 
 def __check_words_in_common(context, group_id: int):
-    players = context.bot_data['games'][group_id]['participants']
-    players_2 = players.copy()
+    players = context.bot_data['games'][group_id].participants
+    # count how many players have sent each word, then strike the words sent by more than one player
+    senders = {}
     for player in players:
-        del players_2[player]
-        words = players[player]['words']
+        for word in players[player].words:
+            senders[word] = senders.get(word, 0) + 1
+    for player in players:
+        words = players[player].words
         for word in words:
-            if not words[word]['sent_by_other_players']:
-                for player_2 in players_2:
-                    words_2 = players_2[player_2]['words']
-                    for word_2 in words_2:
-                        if not words_2[word_2]['sent_by_other_players']:
-                            if word == word_2:
-                                words[word]['sent_by_other_players'] = True
-                                words_2[word_2]['sent_by_other_players'] = True
+            if senders[word] > 1 and not words[word].sent_by_other_players:
+                words[word].sent_by_other_players = True
+                __forget_formatted_words(group_id, player)
 
 
 def __get_formatted_words(context, group_id: int, with_points: bool, only_valid: bool = False,
                           user_id: int = None) -> str:
-    players = context.bot_data['games'][group_id]['participants']
-    res = ""
-
-    def __get_formatted_words_internal(res) -> str:
-        res += f"<b>{players[player]['username']}</b>\n"
-        words = players[player]['words']
-        for word in words:
-            if words[word]['sent_by_other_players'] or words[word]['deleted']:
-                res += "<strike>"
-            else:
-                res += "<i>"
-            res += f"{word}"
-            if with_points:
-                if only_valid:
-                    res += f": {words[word]['points']}" if not words[word]['deleted'] \
-                                                        and not words[word]['sent_by_other_players'] else ""
-                else:
-                    res += f": {words[word]['points']}"
-            if words[word]['sent_by_other_players'] or words[word]['deleted']:
-                res += "</strike>"
-            else:
-                res += "</i>"
-            res += "\n"
-        if len(words) == 0:
-            res += get_string(__get_game_lang(context, group_id), 'no_words_received')
-        return res
-
-    for player in players:
-        if user_id:
-            if player == user_id:
-                res = __get_formatted_words_internal(res)
-                return res
-        else:
-            res = __get_formatted_words_internal(res)
-            res += "\n\n"
-    return res
+    if user_id:
+        return __get_formatted_player_words(context, group_id, user_id, with_points, only_valid)
+    return "".join(__get_formatted_player_words(context, group_id, player, with_points, only_valid) + "\n\n"
+                   for player in context.bot_data['games'][group_id].participants)
+
+
+def __get_formatted_player_words(context, group_id: int, user_id: int, with_points: bool, only_valid: bool) -> str:
+    cache = formatted_words.setdefault(group_id, {}).setdefault(user_id, {})
+    if (with_points, only_valid) not in cache:
+        player = context.bot_data['games'][group_id].participants[user_id]
+        lines = [f"<b>{player.username}</b>"]
+        for word, entry in player.words.items():
+            struck = entry.sent_by_other_players or entry.deleted
+            points = f": {entry.points}" if with_points and not (only_valid and struck) else ""
+            lines.append(f"<strike>{word}{points}</strike>" if struck else f"<i>{word}{points}</i>")
+        text = "\n".join(lines) + "\n"
+        if not player.words:
+            text += get_string(__get_game_lang(context, group_id), 'no_words_received')
+        cache[(with_points, only_valid)] = text
+    return cache[(with_points, only_valid)]
+
+
+def __forget_formatted_words(group_id: int, user_id: int = None):
+    if user_id is None:
+        formatted_words.pop(group_id, None)
+    elif group_id in formatted_words:
+        formatted_words[group_id].pop(user_id, None)
 
 
 def __get_settings_keyboard(chat_id: int, lang: str) -> InlineKeyboardMarkup:
@@ -1877,9 +1928,9 @@ def __show_group_stats(context, group_id: int):
 
     stats = context.bot_data['stats']['groups'][group_id]
     lang = __get_chat_lang(context)
-    text = f"<b>{get_string(lang, 'stats_group_matches')}</b> <code>{stats['matches']}</code>\n" \
-           f"<b>{get_string(lang, 'stats_group_points')}</b> <code>{stats['points']}</code>\n" \
-           f"<b>{get_string(lang, 'stats_group_average')}</b> <code>{stats['average']}</code>"
+    text = f"<b>{get_string(lang, 'stats_group_matches')}</b> <code>{stats.matches}</code>\n" \
+           f"<b>{get_string(lang, 'stats_group_points')}</b> <code>{stats.points}</code>\n" \
+           f"<b>{get_string(lang, 'stats_group_average')}</b> <code>{stats.average}</code>"
 
     context.bot.send_message(chat_id=group_id,
                              text=text,
@@ -1890,17 +1941,13 @@ def __show_user_stats(context, user_id: int, username: str, group_id: int = None
     if not context.bot_data['stats']['users'].get(user_id):
         __init_user_stats(context, user_id, username, group_id, new_player=True)
 
-    # username = context.bot_data['stats']['users'][user_id]['username']
+    # username = context.bot_data['stats']['users'][user_id].username
     stats = context.bot_data['stats']['users'][user_id]
     lang = __get_chat_lang(context)
 
-    latest_game_words = ""
-    if len(stats['matches']['latest']['words']) > 0:
-        for word in stats['matches']['latest']['words']:
-            latest_game_words += f"{word} ({stats['matches']['latest']['words'][word]}), "
-        latest_game_words = latest_game_words[:-2]
+    latest_game_words = ", ".join(f"{word} ({points})" for word, points in stats.latest_words)
 
-    won_latest_match = stats['matches']['latest']['won']
+    won_latest_match = stats.latest_result
     if lang == "ita":
         if won_latest_match == "won":
             won_latest_match = "Vinta"
@@ -1912,18 +1959,18 @@ def __show_user_stats(context, user_id: int, username: str, group_id: int = None
         won_latest_match = won_latest_match.capitalize()
 
     text = f"<b>{get_string(lang, 'stats_user_matches')}</b>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_won_matches')}</i> <code>{stats['matches']['won']['value']} - {stats['matches']['won']['percentage']}%</code>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_even_matches')}</i> <code>{stats['matches']['even']['value']} - {stats['matches']['even']['percentage']}%</code>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_lost_matches')}</i> <code>{stats['matches']['lost']['value']} - {stats['matches']['lost']['percentage']}%</code>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_total_matches')}</i> <code>{stats['matches']['played']}</code>\n\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_won_matches')}</i> <code>{stats.won} - {stats.get_percentage('won')}%</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_even_matches')}</i> <code>{stats.even} - {stats.get_percentage('even')}%</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_lost_matches')}</i> <code>{stats.lost} - {stats.get_percentage('lost')}%</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_total_matches')}</i> <code>{stats.played}</code>\n\n" \
            f"<b>{get_string(lang, 'stats_user_points')}</b>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_max_points')}</i> <code>{stats['points']['max']}</code>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_min_points')}</i> <code>{stats['points']['min']}</code>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_average_points')}</i> <code>{stats['points']['average']}</code>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_total_points')}</i> <code>{stats['points']['total']}</code>\n\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_max_points')}</i> <code>{stats.max_points}</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_min_points')}</i> <code>{stats.min_points}</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_average_points')}</i> <code>{stats.average_points}</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_total_points')}</i> <code>{stats.total_points}</code>\n\n" \
            f"<b>{get_string(lang, 'stats_user_latest_game')}</b>\n" \
            f"<code>    </code><i>{won_latest_match}</i>\n" \
-           f"<code>    </code><i>{get_string(lang, 'stats_user_latest_game_points')}</i> <code>{stats['matches']['latest']['points']}</code>\n" \
+           f"<code>    </code><i>{get_string(lang, 'stats_user_latest_game_points')}</i> <code>{stats.latest_points}</code>\n" \
            f"<code>    </code><i>{get_string(lang, 'stats_user_latest_game_words')} {latest_game_words}</i>"
 
     context.bot.send_message(chat_id=group_id if group_id else user_id,
@@ -1933,20 +1980,85 @@ def __show_user_stats(context, user_id: int, username: str, group_id: int = None
 
 def __check_bot_was_restarted(update, context):
     bd = context.bot_data
-    # to_kill = []
     if not __check_chat_is_group(update):
         return
     group_id = __get_chat_id(update)
-    # for group_id in bd['games']:
-    if group_id in bd['games'] and not (timers['newgame'].get(group_id) or timers['ingame'].get(group_id)):
+    # the timers are scheduled again on restart, so only the games found without a saved deadline can't be resumed
+    game = unrecoverable_games.pop(group_id, None)
+    if game is not None and bd['games'].get(group_id) is game and not game.is_finished:
         context.bot.send_message(chat_id=group_id,
                                  text=get_string(__get_chat_lang(context),
                                                  'game_canceled_because_bot_restarted'))
-            # to_kill.append(group_id)
-    # for group_id in to_kill:
         kill(update, context, bot_restarted=True, group_id=group_id)
 
 
+def __schedule_timer(context, name: str, group_id: int, deadline: float):
+    callbacks = {
+        'newgame': timed('newgame_timer', __newgame_timer),
+        'ingame': timed('ingame_timer', __ingame_timer)
+    }
+    # the deadline tells the timer whether it's still the one of the game, since it can't always be canceled
+    context.job_queue.run_once(callbacks[name], when=max(0, deadline - time()), context=(group_id, deadline),
+                               name=f"{name}_{group_id}")
+
+
+def __cancel_timer(context, name: str, group_id: int):
+    for job in context.job_queue.get_jobs_by_name(f"{name}_{group_id}"):
+        job.schedule_removal()
+
+
+def __get_chat_lock(chat_id: int) -> RLock:
+    return chat_locks.setdefault(chat_id, RLock())
+
+
+def __run_locked(callback):
+    # the handlers run concurrently, but the updates of the same chat are handled one at a time since they share its
+    # chat_data, and the game of a group
+    @wraps(callback)
+    def locked_callback(update, context):
+        chat = update.effective_chat if update else None
+        if chat is None:
+            return callback(update, context)
+        with __get_chat_lock(chat.id):
+            return callback(update, context)
+    return locked_callback
+
+
+def __get_handler_callback(name: str, callback):
+    # the time spent waiting for the lock of the chat is part of the latency of the handler
+    return timed(name, __run_locked(callback))
+
+
+def __get_chat_context(context, chat_id: int):
+    # the context of a job has no chat_data, so the timers use one bound to the chat of their game
+    return SimpleNamespace(bot=context.bot,
+                           bot_data=context.bot_data,
+                           chat_data=context.dispatcher.chat_data[chat_id],
+                           job_queue=context.job_queue,
+                           dispatcher=context.dispatcher)
+
+
+def __restore_timers(dispatcher):
+    # the deadlines of the timers are saved, so the games created before a restart can go on
+    bd = dispatcher.bot_data
+    context = SimpleNamespace(job_queue=dispatcher.job_queue)
+    for chat_id, cd in dispatcher.chat_data.items():
+        deadline = cd.get('timers', {}).get('newgame')
+        if isinstance(deadline, (int, float)):
+            __schedule_timer(context, 'newgame', chat_id, deadline)
+        elif deadline:  # saved as the name of a thread, before the deadlines were saved
+            cd['timers']['newgame'] = None
+            if cd['games'] and not cd['games'][-1].is_finished and chat_id not in bd.get('games', {}):
+                cd['games'].pop()  # the lobby can't be started anymore
+    for group_id, game in bd.get('games', {}).items():
+        if game.is_finished:
+            continue
+        if isinstance(game.ingame_timer, (int, float)):
+            __schedule_timer(context, 'ingame', group_id, game.ingame_timer)
+        else:
+            unrecoverable_games[group_id] = game
+
+
 def __get_group_name(update) -> str:
     return update.message.chat.title
 
@@ -1971,59 +2083,106 @@ def __get_chat_id_from_query(query) -> int:
     return query.message.chat_id
 
 
+def register_handlers(dp):
+    """Prepare the data loaded by the persistence of the dispatcher and register all the handlers of the bot."""
+    __check_bot_data_is_initialized(SimpleNamespace(bot_data=dp.bot_data))
+    __convert_table_grids(SimpleNamespace(bot_data=dp.bot_data))
+    __init_group_users_stats(dp)
+    __sort_games_by_creation(dp.chat_data)
+    __restore_timers(dp)
+
+    commands = {
+        'start': start,
+        'new': new,
+        'join': join,
+        'startgame': start_game,
+        'delete': delete,
+        'isthere': isthere,
+        'endgame': end_game,
+        'leave': leave,
+        'last': last,
+        'kick': kick,
+        'kill': kill,
+        'stats': show_statistics,
+        'top': top,
+        'settings': settings,
+        'notify': notify,
+        'rules': show_rules,
+        'usage': show_usage,
+        'help': show_help,
+        'profile': start_profiler
+    }
+    for command, callback in commands.items():
+        dp.add_handler(CommandHandler(command, __get_handler_callback(command, callback), run_async=True))
+
+    # handles all text messages in a private chat
+    dp.add_handler(MessageHandler(Filters.text & ~ Filters.chat_type.group,
+                                  __get_handler_callback('points_handler', points_handler), run_async=True))
+    dp.add_handler(MessageHandler(Filters.status_update.new_chat_members,
+                                  __get_handler_callback('bot_added_to_group', bot_added_to_group), run_async=True))
+
+    # handles callback queries from InlineKeyboardButtons
+    dp.add_handler(CallbackQueryHandler(__get_handler_callback('query_handler', query_handler), run_async=True))
+
+    # log all errors
+    dp.add_error_handler(error)
+
+
 def main():
     def open_db():
-        return PicklePersistence(filename='_boggle_paroliere_bot_db')
+        return SQLitePersistence(filename=db_filename, legacy_filename=legacy_db_filename, store_user_data=False)
 
     def get_updater():
-        return Updater(token, persistence=open_db(), use_context=True, request_kwargs={'read_timeout': 10})
+        # the connection pool is shared by the dispatcher workers, the updater and the delivery workers
+        request = MetricsRequest(read_timeout=10, con_pool_size=dispatcher_workers + 4 + delivery_workers)
+        return Updater(bot=Bot(token, base_url=bot_api_url, request=request), persistence=open_db(),
+                       use_context=True, workers=dispatcher_workers)
 
     try:
         updater = get_updater()
     except TypeError:
         old_db_name = f"_boggle_paroliere_bot_db.bak_{int(time())}"
-        shutil.copy("_boggle_paroliere_bot_db", os.path.join("dbs_old", old_db_name))
-        os.remove("_boggle_paroliere_bot_db")
+        shutil.copy(legacy_db_filename, os.path.join("dbs_old", old_db_name))
+        os.remove(legacy_db_filename)
+        logger.error(f"The database was corrupted. It has been saved as dbs_old/{old_db_name} and has now been reset.")
+        updater = get_updater()
+    except sqlite3.DatabaseError:
+        old_db_name = f"_boggle_paroliere_bot_db.sqlite.bak_{int(time())}"
+        shutil.move(db_filename, os.path.join("dbs_old", old_db_name))
+        for suffix in ["-wal", "-shm"]:
+            if os.path.isfile(db_filename + suffix):
+                os.remove(db_filename + suffix)
         logger.error(f"The database was corrupted. It has been saved as dbs_old/{old_db_name} and has now been reset.")
         updater = get_updater()
 
     # Get the dispatcher to register handlers
-    dp = updater.dispatcher
-
-    dp.add_handler(CommandHandler('start', start))
-    dp.add_handler(CommandHandler('new', new))
-    dp.add_handler(CommandHandler('join', join))
-    dp.add_handler(CommandHandler('startgame', start_game))
-    dp.add_handler(CommandHandler('delete', delete))
-    dp.add_handler(CommandHandler('isthere', isthere))
-    dp.add_handler(CommandHandler('endgame', end_game))
-    dp.add_handler(CommandHandler('leave', leave))
-    dp.add_handler(CommandHandler('last', last))
-    dp.add_handler(CommandHandler('kick', kick))
-    dp.add_handler(CommandHandler('kill', kill))
-    dp.add_handler(CommandHandler('stats', show_statistics))
-    dp.add_handler(CommandHandler('settings', settings))
-    dp.add_handler(CommandHandler('notify', notify))
-    dp.add_handler(CommandHandler('rules', show_rules))
-    dp.add_handler(CommandHandler('usage', show_usage))
-    dp.add_handler(CommandHandler('help', show_help))
+    register_handlers(updater.dispatcher)
 
-    # handles all text messages in a private chat
-    dp.add_handler(MessageHandler(Filters.text & ~ Filters.chat_type.group, points_handler))
-    dp.add_handler(MessageHandler(Filters.status_update.new_chat_members, bot_added_to_group))
-
-    # handles callback queries from InlineKeyboardButtons
-    dp.add_handler(CallbackQueryHandler(query_handler))
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
 
-    # log all errors
-    dp.add_error_handler(error)
+    # the word lists are compiled before the first words are received, and not by the handlers
+    load_dictionaries()
+    # keep some boards ready for the next games
+    start_board_pool()
+    start_notifications()
 
     # Start the Bot
-    updater.start_polling()
+    if webhook_url:
+        updater.start_webhook(listen=webhook_listen,
+                              port=webhook_port,
+                              url_path=webhook_path,
+                              cert=webhook_cert,
+                              key=webhook_key,
+                              webhook_url=f"{webhook_url.rstrip('/')}/{webhook_path}",
+                              max_connections=dispatcher_workers)
+        logger.info(f"Listening for updates on {webhook_listen}:{webhook_port}")
+    else:
+        updater.start_polling()
 
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
     # SIGTERM or SIGABRT. This should be used most of the time, since
-    # start_polling() is non-blocking and will stop the bot gracefully.
+    # start_polling() and start_webhook() are non-blocking and will stop the bot gracefully.
     updater.idle()
 
 
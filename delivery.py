@@ -0,0 +1,207 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from heapq import heappush, heappop
+from itertools import count
+from queue import Queue, Empty
+from threading import Thread, Lock, Condition
+from time import monotonic
+
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+workers = 8  # messages sent at the same time, the connection pool of the bot must be at least this big
+# Telegram allows about 30 messages per second overall and 1 per second to the same chat, with short bursts
+global_rate = 30
+global_burst = 30
+chat_rate = 1
+chat_burst = 3
+# and about 20 messages per minute to the same group, edits included
+group_rate = 20 / 60
+group_burst = 20
+max_retries = 3  # times a message is sent again after a RetryAfter error
+notifications_batch_size = 100
+notifications_batch_wait = 1  # seconds to wait for more notifications to send in the same batch
+
+__executor = None
+__lock = Lock()
+# the workers only make the requests: the calls wait for their turn in __pending, a heap of (not before, sequence
+# number, call) taken by the scheduler thread, so that a chat waiting for the rate limits doesn't hold up the others
+__scheduled = Condition(__lock)
+__pending = []
+__sequence = count()
+__global_bucket = {'tokens': global_burst, 'updated': monotonic(), 'rate': global_rate, 'burst': global_burst}
+__chat_buckets = {}  # (chat_id, rate, burst) -> bucket
+__notifications = Queue()
+
+
+def send_messages(bot, chat_ids, text, description: str = "messages", **kwargs) -> dict:
+    """
+    Send a message to all the given chats concurrently, within the rate limits of Telegram, and return a dict with the
+    chats the message couldn't be sent to and the error raised for each one.
+    text is either the same text for all the chats or a dict with the text for each chat.
+    The time each chat received the message after the first send is logged, so that the spread can be monitored.
+    """
+    texts = text if isinstance(text, dict) else {chat_id: text for chat_id in chat_ids}
+    return __fan_out(bot.send_message,
+                     {chat_id: dict(kwargs, chat_id=chat_id, text=texts[chat_id]) for chat_id in chat_ids},
+                     description)
+
+
+def edit_messages(bot, chat_id: int, texts: dict, description: str = "edits", **kwargs) -> dict:
+    """
+    Edit the messages of a chat concurrently, texts being a dict with the new text of each message_id, and return a
+    dict with the messages which couldn't be edited and the error raised for each one.
+    """
+    # the edits aren't subject to the limit of the messages sent to the same chat, only to the one of the group
+    return __fan_out(bot.edit_message_text,
+                     {message_id: dict(kwargs, chat_id=chat_id, message_id=message_id, text=text)
+                      for message_id, text in texts.items()},
+                     description, chat_limit=False)
+
+
+def __fan_out(method, requests: dict, description: str, chat_limit: bool = True) -> dict:
+    global __executor
+    with __lock:
+        if __executor is None:
+            __executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery")
+            Thread(target=__run_scheduler, name="delivery_scheduler", daemon=True).start()
+    start = monotonic()
+    futures = {}
+    for key, request in requests.items():
+        chat_id = request['chat_id']
+        buckets = [__get_chat_bucket(chat_id, chat_rate, chat_burst)] if chat_limit else []
+        if chat_id < 0:
+            buckets.append(__get_chat_bucket(chat_id, group_rate, group_burst))
+        futures[key] = Future()
+        __schedule({'method': method, 'request': request, 'buckets': buckets, 'retries': 0, 'future': futures[key]},
+                   start)
+    latencies = {}
+    errors = {}
+    for key, future in futures.items():
+        try:
+            latencies[key] = (future.result() - start) * 1000
+        except TelegramError as e:
+            errors[key] = e
+    if latencies:
+        logger.info(f"Delivered {len(latencies)}/{len(futures)} {description}: first after"
+                    f" {min(latencies.values()):.0f} ms, last after {max(latencies.values()):.0f} ms")
+        logger.debug(f"Latency of {description} per recipient (ms): "
+                     + ", ".join(f"{key}: {latency:.0f}" for key, latency in latencies.items()))
+    return errors
+
+
+def enqueue_notifications(bot, chat_ids, text: str, **kwargs):
+    """Queue the same message for the given chats, it will be sent in the background by the notifications thread."""
+    for chat_id in chat_ids:
+        __notifications.put((bot, chat_id, text, kwargs))
+
+
+def start_notifications():
+    Thread(target=__send_notifications, name="notifications", daemon=True).start()
+
+
+def __send_notifications():
+    while True:
+        batch = [__notifications.get()]
+        deadline = monotonic() + notifications_batch_wait
+        while len(batch) < notifications_batch_size:
+            try:
+                batch.append(__notifications.get(timeout=max(0, deadline - monotonic())))
+            except Empty:
+                break
+        # the same message is sent once to each chat, no matter how many times it has been queued
+        messages = {}
+        for bot, chat_id, text, kwargs in batch:
+            key = (text, tuple(sorted(kwargs.items())))
+            messages.setdefault(key, (bot, kwargs, {}))[2][str(chat_id)] = chat_id
+        for (text, _), (bot, kwargs, chat_ids) in messages.items():
+            try:
+                errors = send_messages(bot, list(chat_ids.values()), text, description="notifications", **kwargs)
+            except Exception:
+                logger.exception("Could not send a batch of notifications")
+                continue
+            for chat_id, error in errors.items():
+                # the user has blocked the bot or deleted their account
+                logger.debug(f"Could not notify {chat_id}: {error}")
+
+
+def __schedule(call: dict, not_before: float):
+    with __scheduled:
+        heappush(__pending, (not_before, next(__sequence), call))
+        __scheduled.notify()
+
+
+def __run_scheduler():
+    while True:
+        with __scheduled:
+            call, wait = __pop_call(monotonic())
+            while call is None:
+                __scheduled.wait(wait)
+                call, wait = __pop_call(monotonic())
+        __executor.submit(__call, call)
+
+
+def __pop_call(now: float) -> tuple:
+    # return the next call which can be made now, or None and the seconds to wait for one (None until a call is
+    # scheduled), called with __lock held
+    while __pending:
+        if __pending[0][0] > now:
+            return None, __pending[0][0] - now
+        # every call needs a token of the global bucket
+        wait = __get_wait(__global_bucket, now)
+        if wait > 0:
+            return None, wait
+        _, _, call = heappop(__pending)
+        wait = max([__get_wait(bucket, now) for bucket in call['buckets']], default=0)
+        if wait > 0:
+            # the chat has to wait, the calls to the other chats go on in the meantime
+            heappush(__pending, (now + wait, next(__sequence), call))
+            continue
+        __global_bucket['tokens'] -= 1
+        for bucket in call['buckets']:
+            bucket['tokens'] -= 1
+        return call, None
+    return None, None
+
+
+def __call(call: dict):
+    request = call['request']
+    try:
+        call['method'](**request)
+    except RetryAfter as e:
+        if call['retries'] == max_retries:
+            call['future'].set_exception(e)
+            return
+        logger.warning(f"Flood limit reached sending to {request['chat_id']}, retrying in {e.retry_after} seconds")
+        with __lock:
+            # empty the buckets of the chat, so that the next messages to it wait as well
+            for bucket in call['buckets']:
+                bucket['tokens'] = min(bucket['tokens'], 1 - e.retry_after * bucket['rate'])
+        call['retries'] += 1
+        __schedule(call, monotonic() + e.retry_after)
+    except Exception as e:
+        call['future'].set_exception(e)
+    else:
+        call['future'].set_result(monotonic())
+
+
+def __get_chat_bucket(chat_id: int, rate: float, burst: int) -> dict:
+    key = (chat_id, rate, burst)
+    with __lock:
+        if key not in __chat_buckets:
+            if len(__chat_buckets) > 10000:
+                # a bucket which has been refilled is the same as a new one
+                now = monotonic()
+                for idle in [k for k, b in __chat_buckets.items() if now - b['updated'] > b['burst'] / b['rate']]:
+                    del __chat_buckets[idle]
+            __chat_buckets[key] = {'tokens': burst, 'updated': monotonic(), 'rate': rate, 'burst': burst}
+        return __chat_buckets[key]
+
+
+def __get_wait(bucket: dict, now: float) -> float:
+    # token bucket: refill the bucket at its rate in tokens per second up to its burst, and return the seconds until
+    # there's a token, called with __lock held
+    bucket['tokens'] = min(bucket['burst'], bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+    bucket['updated'] = now
+    return (1 - bucket['tokens']) / bucket['rate'] if bucket['tokens'] < 1 else 0
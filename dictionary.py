@@ -0,0 +1,172 @@
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from string import ascii_lowercase
+from threading import Lock
+
+from translations import available_languages
+
+logger = logging.getLogger(__name__)
+
+word_lists_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'word_lists')
+
+__magic = b'BDWG'
+__version = 1
+__header = struct.Struct('<4sIII')  # magic, version, number of nodes, number of edges
+
+__lock = Lock()  # held while a dictionary is loaded, so that it's only compiled once
+__dictionaries = {}
+__ascii_letters = set(ascii_lowercase)
+
+
+class Dictionary:
+    """
+    A DAWG (a trie whose common suffixes have been merged) stored as flat arrays, so that it can be
+    memory-mapped straight from its compiled file.
+    Node n has the outgoing edges offsets[n]:offsets[n+1], each one with a letter in labels and a destination
+    node in targets. Node 0 is the root.
+    Words are stored the same way the table grid stores them, i.e. with "Qu" as "q".
+    """
+    root = 0
+
+    def __init__(self, offsets, labels, targets, terminals):
+        self._offsets = offsets
+        self._labels = labels
+        self._targets = targets
+        self._terminals = terminals
+
+    def child(self, node: int, letter: str) -> int:
+        """Return the node reached from node through letter, or -1 if there's no such edge."""
+        code = ord(letter)
+        labels = self._labels
+        for edge in range(self._offsets[node], self._offsets[node + 1]):
+            if labels[edge] == code:
+                return self._targets[edge]
+        return -1
+
+    def is_word(self, node: int) -> bool:
+        return self._terminals[node] == 1
+
+    def __contains__(self, word: str) -> bool:
+        node = self.root
+        for letter in word:
+            node = self.child(node, letter)
+            if node == -1:
+                return False
+        return self.is_word(node)
+
+
+def get_dictionary(lang: str):
+    """Return the Dictionary for the given language, or None if there's no word list for it."""
+    if lang not in __dictionaries:
+        with __lock:
+            if lang not in __dictionaries:
+                __dictionaries[lang] = __load_dictionary(lang)
+    return __dictionaries[lang]
+
+
+def load_dictionaries():
+    """Load the dictionaries of all the languages, compiling their word lists if needed, before they're used."""
+    for lang in available_languages:
+        get_dictionary(lang)
+
+
+def compile_word_list(src: str, dst: str):
+    words = set()
+    with open(src, encoding='utf-8') as f:
+        for line in f:
+            word = to_grid_word(line.strip().lower())
+            if word:
+                words.add(word)
+
+    # build a plain trie, then merge equivalent nodes bottom-up to get a DAWG
+    trie = {}
+    for word in words:
+        node = trie
+        for letter in word:
+            node = node.setdefault(letter, {})
+        node[''] = True
+
+    registry = {}
+    offsets = array('i', [0])
+    labels = array('B')
+    targets = array('i')
+    terminals = array('B')
+    # nodes are emitted in post-order, so the root has to be swapped into position 0 at the end
+    order = []
+
+    def __minimize(node) -> int:
+        edges = tuple(sorted((letter, __minimize(child)) for letter, child in node.items() if letter != ''))
+        signature = ('' in node, edges)
+        if signature not in registry:
+            registry[signature] = len(order)
+            order.append(signature)
+        return registry[signature]
+
+    root = __minimize(trie)
+    position = list(range(len(order)))
+    position[0], position[root] = root, 0
+    for node_id in position:
+        is_word, edges = order[node_id]
+        for letter, child in edges:
+            labels.append(ord(letter))
+            targets.append(position[child])
+        offsets.append(len(labels))
+        terminals.append(1 if is_word else 0)
+
+    # the board pool workers and the shards can compile the same word list at the same time, each one writes its own
+    # temporary file and the last one replaces the other
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(dst) or ".", prefix=os.path.basename(dst) + ".",
+                                     suffix=".tmp", delete=False) as f:
+        try:
+            f.write(__header.pack(__magic, __version, len(terminals), len(labels)))
+            for data in (offsets, targets, labels, terminals):
+                data.tofile(f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.chmod(f.name, 0o644)  # temporary files are only readable by their owner
+    os.replace(f.name, dst)
+    logger.info(f"Compiled {len(words)} words from {src} into {len(terminals)} nodes and {len(labels)} edges.")
+
+
+def to_grid_word(word: str) -> str:
+    if not word or not set(word) <= __ascii_letters or word.count("q") != word.count("qu"):
+        return ""
+    return word.replace("qu", "q")
+
+
+def __load_dictionary(lang: str):
+    src = os.path.join(word_lists_dir, f"{lang}.txt")
+    dst = os.path.join(word_lists_dir, f"{lang}.dawg")
+    if not os.path.isfile(src) and not os.path.isfile(dst):
+        logger.warning(f"No word list found for language {lang}, words won't be checked against a dictionary.")
+        return None
+    if os.path.isfile(src) and (not os.path.isfile(dst) or os.path.getmtime(src) > os.path.getmtime(dst)):
+        compile_word_list(src, dst)
+
+    with open(dst, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, nodes, edges = __header.unpack_from(buffer)
+    if magic != __magic or version != __version:
+        raise ValueError(f"{dst} is not a compiled word list, delete it to rebuild it from {src}.")
+
+    view = memoryview(buffer)[__header.size:]
+    int_size = array('i').itemsize
+    sizes = [((nodes + 1) * int_size, 'i'), (edges * int_size, 'i'), (edges, 'B'), (nodes, 'B')]
+    sections = []
+    for size, fmt in sizes:
+        sections.append(view[:size].cast(fmt))
+        view = view[size:]
+    offsets, targets, labels, terminals = sections
+    return Dictionary(offsets, labels, targets, terminals)
+
+
+if __name__ == '__main__':
+    for language in available_languages:
+        dictionary = get_dictionary(language)
+        print(language, dictionary is not None and "casa" in dictionary)
@@ -5,7 +5,12 @@ WORKDIR=/bot
 
 docker run --restart unless-stopped \
            -v "$PWD"/$DB:$WORKDIR/$DB \
+           -v "$PWD"/db:$WORKDIR/db \
+           -v "$PWD"/archive:$WORKDIR/archive \
            -v "$PWD"/dbs_old:$WORKDIR/dbs_old \
+           -v "$PWD"/word_lists:$WORKDIR/word_lists \
            -e TOKEN="" \
            -e CST_CID="" \
+           -e WEBHOOK_URL="" \
+           -p 8443:8443 \
            -itd bogglebot:latest
\ No newline at end of file
@@ -0,0 +1,62 @@
+from bisect import bisect_left, insort
+from threading import Lock
+
+# the players who have played fewer games aren't ranked by win rate and average points, where a single lucky game
+# would put them on top
+min_played = 5
+size = 10  # players shown in a leaderboard
+
+metrics = {
+    'points': lambda stats: stats.total_points,
+    'wins': lambda stats: stats.get_percentage('won'),
+    'average': lambda stats: stats.average_points,
+}
+
+__lock = Lock()
+# scope (None for all the users of the bot, or a group_id) -> metric -> sorted list of (-value, user_id)
+__indexes = {}
+# scope -> user_id -> metric -> the (-value, user_id) of the user in the index, to find it with a bisection
+__entries = {}
+
+
+def update(scope, user_id: int, stats):
+    """Move the user to the position of their new statistics in the leaderboards of scope, if they've been built."""
+    with __lock:
+        if scope not in __indexes:
+            return  # built from all the statistics when it's first shown
+        __update(scope, user_id, stats)
+
+
+def get_top(scope, metric: str, all_stats: dict, n: int = size) -> list:
+    """
+    Return the first n (user_id, value) of the leaderboard of scope by metric, building its indexes from all_stats,
+    user_id -> UserStats, if it's the first time it's asked for.
+    """
+    with __lock:
+        if scope not in __indexes:
+            __entries[scope] = {user_id: __get_entries(user_id, stats) for user_id, stats in all_stats.items()}
+            __indexes[scope] = {name: sorted(entries[name] for entries in __entries[scope].values() if name in entries)
+                                for name in metrics}
+        return [(user_id, -value) for value, user_id in __indexes[scope][metric][:n]]
+
+
+def clear():
+    with __lock:
+        __indexes.clear()
+        __entries.clear()
+
+
+def __update(scope, user_id: int, stats):
+    old_entries = __entries[scope].get(user_id, {})
+    new_entries = __entries[scope][user_id] = __get_entries(user_id, stats)
+    for metric in metrics:
+        index = __indexes[scope][metric]
+        if metric in old_entries:
+            del index[bisect_left(index, old_entries[metric])]
+        if metric in new_entries:
+            insort(index, new_entries[metric])
+
+
+def __get_entries(user_id: int, stats) -> dict:
+    return {metric: (-get_value(stats), user_id) for metric, get_value in metrics.items()
+            if stats.played >= (1 if metric == 'points' else min_played)}
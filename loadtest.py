@@ -0,0 +1,293 @@
+"""
+Load test of the bot against a fake Telegram Bot API server, run with: python loadtest.py --groups 500
+Each group plays a scripted game: the creator sends /new, the other players /join, the creator /startgame, every
+player sends some words in a private chat and, once the ingame timer has expired, the creator sends /endgame. Then the
+last player asks to be notified of the next game, the creator sends /new and, once the notification has been received,
+/kill. A game isn't completed if the notification wasn't received.
+The throughput of the updates, the percentiles of the time between an update and the reply of the bot and the memory
+of the process are reported at the end of each round.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+from collections import defaultdict, deque
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from itertools import count
+from queue import Queue, Empty
+from socketserver import ThreadingMixIn
+from threading import Thread, Lock
+from time import time, sleep, monotonic
+
+# the bot reads its configuration from the environment as soon as it's imported
+os.environ.setdefault("TOKEN", "123456:loadtest")
+os.environ.setdefault("CST_CID", "0")
+
+import archive  # noqa: E402
+import boards  # noqa: E402
+import boggle_telegram_bot as boggle  # noqa: E402
+import delivery  # noqa: E402
+import dictionary  # noqa: E402
+from persistence import SQLitePersistence  # noqa: E402
+from solver import get_grid_neighbours  # noqa: E402
+from telegram.ext import Updater  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)  # only the report is printed
+
+bot_user = {'id': 1, 'is_bot': True, 'first_name': "Boggle", 'username': "boggle_loadtest_bot"}
+
+
+class FakeBotAPI(ThreadingMixIn, HTTPServer):
+    """A stand-in for the Bot API, which delivers the queued updates and records the calls made by the bot."""
+    daemon_threads = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(("127.0.0.1", port), FakeBotAPIHandler)
+        self.updates = Queue()
+        self.update_ids = count(1)
+        self.message_ids = count(1)
+        self.lock = Lock()
+        self.calls = defaultdict(int)
+        self.pending = defaultdict(deque)  # chat_id -> times the updates of the chat waiting for a reply were sent
+        self.texts = defaultdict(list)  # chat_id -> texts of the messages sent to the chat
+        self.latencies = []
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/bot"
+
+    def send_update(self, chat_id: int, user_id: int, text: str):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time()),
+            'chat': {'id': chat_id, 'type': 'group' if chat_id < 0 else 'private', 'title': f"Group {chat_id}"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Player {user_id}", 'username': f"player{user_id}"},
+            'text': text
+        }
+        if text.startswith("/"):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        with self.lock:
+            self.pending[chat_id].append(monotonic())
+        self.updates.put({'update_id': next(self.update_ids), 'message': message})
+
+    def send_callback_query(self, chat_id: int, user_id: int, data: str):
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"Player {user_id}", 'username': f"player{user_id}"}
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time()),
+            'chat': {'id': chat_id, 'type': 'group', 'title': f"Group {chat_id}"},
+            'from': bot_user,
+            'text': "/notify"
+        }
+        with self.lock:
+            self.pending[chat_id].append(monotonic())
+        self.updates.put({'update_id': next(self.update_ids),
+                          'callback_query': {'id': str(next(self.update_ids)), 'from': user, 'message': message,
+                                             'chat_instance': str(chat_id), 'data': data}})
+
+    def wait_replies(self, chat_id: int, timeout: float = 60):
+        deadline = monotonic() + timeout
+        while self.pending[chat_id] and monotonic() < deadline:
+            sleep(0.05)
+
+    def call(self, method: str, params: dict):
+        with self.lock:
+            self.calls[method] += 1
+        if method == 'getUpdates':
+            return self.__get_updates(float(params.get('timeout', 0)))
+        if method == 'getMe':
+            return bot_user
+        if method == 'getChatAdministrators':
+            return []
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params['chat_id'])
+            with self.lock:
+                if method == 'sendMessage':
+                    self.texts[chat_id].append(params.get('text', ""))
+                if self.pending[chat_id]:
+                    self.latencies.append(monotonic() - self.pending[chat_id].popleft())
+            return {
+                'message_id': int(params.get('message_id') or next(self.message_ids)),
+                'date': int(time()),
+                'chat': {'id': chat_id, 'type': 'group' if chat_id < 0 else 'private'},
+                'from': bot_user,
+                'text': params.get('text', "")
+            }
+        return True
+
+    def __get_updates(self, timeout: float) -> list:
+        updates = []
+        try:
+            updates.append(self.updates.get(timeout=min(timeout, 1)))
+            while len(updates) < 100:
+                updates.append(self.updates.get_nowait())
+        except Empty:
+            pass
+        return updates
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:  # a multipart upload
+            params = {'chat_id': 0}
+        response = json.dumps({'ok': True, 'result': self.server.call(method, params)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+def get_traceable_words(grid: str, number: int) -> list:
+    neighbours = get_grid_neighbours(grid)
+    words = []
+    for _ in range(number):
+        position = random.randrange(len(grid))
+        path = [position]
+        for _ in range(random.randint(2, 5)):
+            options = [p for p in neighbours[path[-1]] if p not in path]
+            if not options:
+                break
+            path.append(random.choice(options))
+        words.append("".join(grid[p] for p in path).replace("q", "qu"))
+    return words
+
+
+def play_game(api: FakeBotAPI, dp, group_id: int, players: list, words: int, ingame: int):
+    creator = players[0]
+    api.send_update(group_id, creator, "/new")
+    api.wait_replies(group_id)
+    dp.chat_data[group_id]['timers']['durations']['ingame'] = ingame
+    for player in players[1:]:
+        api.send_update(group_id, player, "/join")
+    api.wait_replies(group_id)
+    api.send_update(group_id, creator, "/startgame")
+    api.wait_replies(group_id)
+
+    game = __wait_for(lambda: dp.bot_data['games'].get(group_id) if getattr(dp.bot_data['games'].get(group_id),
+                                                                             'ingame_timer', None) else None)
+    if game is None:
+        return False
+    for player in players:
+        for word in get_traceable_words(game.table_grid, words):
+            api.send_update(player, player, word)
+    for player in players:
+        api.wait_replies(player)
+
+    if not __wait_for(lambda: game.is_finished and all(participant.result_message_id is not None
+                                                       for participant in game.participants.values()),
+                      timeout=ingame + 60):
+        return False
+    api.send_update(group_id, creator, "/endgame")
+    api.wait_replies(group_id)
+    if __wait_for(lambda: group_id not in dp.bot_data['games']) is None:
+        return False
+
+    # the user_id in the data of the button is a string, as when the button is pressed in Telegram
+    api.send_callback_query(group_id, players[-1], f"notify_justonce_{group_id}_{players[-1]}_player{players[-1]}")
+    api.wait_replies(group_id)
+    notifications = len(api.texts[players[-1]])
+    api.send_update(group_id, creator, "/new")
+    api.wait_replies(group_id)
+    notified = __wait_for(lambda: any(f"Group {group_id}" in text for text in api.texts[players[-1]][notifications:]))
+    api.send_update(group_id, creator, "/kill")
+    api.wait_replies(group_id)
+    return notified is not None
+
+
+def get_memory() -> dict:
+    memory = {'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if os.path.isfile("/proc/self/statm"):
+        with open("/proc/self/statm") as f:
+            memory['rss_mb'] = int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    return memory
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the bot against a fake Telegram Bot API server.")
+    parser.add_argument("--groups", type=int, default=100, help="groups playing at the same time")
+    parser.add_argument("--players", type=int, default=4, help="players in each group")
+    parser.add_argument("--words", type=int, default=10, help="words sent by each player")
+    parser.add_argument("--ingame", type=int, default=5, help="seconds of the ingame timer")
+    parser.add_argument("--rounds", type=int, default=1, help="games played by each group, to see the memory growth")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    Thread(target=api.serve_forever, name="fake_bot_api", daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix="boggle_loadtest_")
+    archive.archive_dir = os.path.join(workdir, "archive")
+    boards.pool_filename = None
+    persistence = SQLitePersistence(filename=os.path.join(workdir, "db.sqlite"), store_user_data=False)
+    updater = Updater(boggle.token, persistence=persistence, use_context=True, base_url=api.base_url,
+                      workers=boggle.dispatcher_workers,
+                      request_kwargs={'con_pool_size': boggle.dispatcher_workers + 4 + boggle.delivery_workers})
+    boggle.register_handlers(updater.dispatcher)
+    dictionary.load_dictionaries()
+    boards.start_board_pool()
+    delivery.start_notifications()
+    updater.start_polling(poll_interval=0, timeout=1)
+
+    print(f"{args.groups} groups, {args.players} players per group, {args.words} words per player,"
+          f" database in {workdir}")
+    print(f"memory before: {get_memory()}")
+    for round_number in range(1, args.rounds + 1):
+        api.latencies = []
+        api.calls.clear()
+        first_update_id = next(api.update_ids)
+        results = []
+        start = monotonic()
+        threads = []
+        for group in range(args.groups):
+            players = [(round_number * args.groups + group) * args.players + player + 1000
+                       for player in range(args.players)]
+            thread = Thread(target=lambda g=-(group + 1), p=players: results.append(
+                play_game(api, updater.dispatcher, g, p, args.words, args.ingame)))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        elapsed = monotonic() - start
+        updates = next(api.update_ids) - first_update_id - 1
+        print(f"round {round_number}: {results.count(True)}/{args.groups} games completed in {elapsed:.1f} s,"
+              f" {updates} updates ({updates / elapsed:.1f}/s), {sum(api.calls.values())} API calls"
+              f" {dict(api.calls)}")
+        print(f"    reply latency: p50 {percentile(api.latencies, 50) * 1000:.0f} ms,"
+              f" p90 {percentile(api.latencies, 90) * 1000:.0f} ms,"
+              f" p99 {percentile(api.latencies, 99) * 1000:.0f} ms,"
+              f" max {max(api.latencies, default=0) * 1000:.0f} ms")
+        print(f"    memory: {get_memory()}")
+
+    updater.stop()
+    persistence.flush()
+    api.shutdown()
+
+
+def __wait_for(condition, timeout: float = 60):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        sleep(0.1)
+    return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import logging
+from collections import deque
+from functools import wraps
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from time import perf_counter
+
+from telegram.utils.request import Request
+
+logger = logging.getLogger(__name__)
+
+window = 1000  # latest latencies of each handler used for the quantiles
+quantiles = [0.5, 0.95]
+
+# not private, since they're used by MetricsRequest as well
+stats_lock = Lock()
+handler_stats = {}  # name -> calls, errors, total seconds and latest latencies
+api_stats = {}  # Bot API method -> calls, errors and total seconds
+
+
+def timed(name: str, callback):
+    """Wrap a handler or a job callback, counting its calls and errors and measuring its latency."""
+    @wraps(callback)
+    def timed_callback(*args, **kwargs):
+        start = perf_counter()
+        error = False
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            __observe(name, perf_counter() - start, error)
+    return timed_callback
+
+
+class MetricsRequest(Request):
+    """A Request which counts the calls to each method of the Bot API, their errors and the time they take."""
+
+    def post(self, url: str, data, timeout: float = None):
+        method = url.rsplit("/", 1)[-1]
+        start = perf_counter()
+        error = False
+        try:
+            return super().post(url, data, timeout=timeout)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            with stats_lock:
+                stats = api_stats.setdefault(method, {'calls': 0, 'errors': 0, 'seconds': 0.0})
+                stats['calls'] += 1
+                stats['errors'] += error
+                stats['seconds'] += elapsed
+
+
+def start_metrics_server(port: int, address: str = "0.0.0.0"):
+    """Serve the metrics in the Prometheus text format on http://address:port/metrics"""
+    server = HTTPServer((address, port), MetricsHandler)
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving the metrics on {address}:{port}/metrics")
+
+
+def get_metrics() -> str:
+    with stats_lock:
+        handlers = {name: dict(stats, latencies=sorted(stats['latencies'])) for name, stats in handler_stats.items()}
+        api = {method: dict(stats) for method, stats in api_stats.items()}
+    lines = [
+        "# HELP boggle_handler_seconds Time spent handling an update or running a timer.",
+        "# TYPE boggle_handler_seconds summary"
+    ]
+    for name, stats in handlers.items():
+        latencies = stats['latencies']
+        for quantile in quantiles:
+            value = latencies[min(len(latencies) - 1, int(len(latencies) * quantile))] if latencies else 0
+            lines.append(f'boggle_handler_seconds{{handler="{name}",quantile="{quantile}"}} {value:.6f}')
+        lines.append(f'boggle_handler_seconds_sum{{handler="{name}"}} {stats["seconds"]:.6f}')
+        lines.append(f'boggle_handler_seconds_count{{handler="{name}"}} {stats["calls"]}')
+    lines += [
+        "# HELP boggle_handler_errors_total Updates or timers whose handler raised an exception.",
+        "# TYPE boggle_handler_errors_total counter"
+    ]
+    lines += [f'boggle_handler_errors_total{{handler="{name}"}} {stats["errors"]}' for name, stats in handlers.items()]
+    lines += [
+        "# HELP boggle_api_requests_total Requests made to the Bot API.",
+        "# TYPE boggle_api_requests_total counter"
+    ]
+    lines += [f'boggle_api_requests_total{{method="{method}"}} {stats["calls"]}' for method, stats in api.items()]
+    lines += [
+        "# HELP boggle_api_request_errors_total Requests to the Bot API which failed.",
+        "# TYPE boggle_api_request_errors_total counter"
+    ]
+    lines += [f'boggle_api_request_errors_total{{method="{method}"}} {stats["errors"]}'
+              for method, stats in api.items()]
+    lines += [
+        "# HELP boggle_api_request_seconds_total Time spent waiting for the Bot API.",
+        "# TYPE boggle_api_request_seconds_total counter"
+    ]
+    lines += [f'boggle_api_request_seconds_total{{method="{method}"}} {stats["seconds"]:.6f}'
+              for method, stats in api.items()]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def __observe(name: str, elapsed: float, error: bool):
+    with stats_lock:
+        stats = handler_stats.setdefault(name, {'calls': 0, 'errors': 0, 'seconds': 0.0,
+                                             'latencies': deque(maxlen=window)})
+        stats['calls'] += 1
+        stats['errors'] += error
+        stats['seconds'] += elapsed
+        stats['latencies'].append(elapsed)
@@ -0,0 +1,250 @@
+"""
+The games and the statistics of the bot, as classes with __slots__ instead of nested dicts, so that they take less
+memory and are faster to pickle.
+to_dict and from_dict convert them to and from the nested dicts they used to be, which are still the layout of the
+games in the archive and of the rows of the databases saved before the models.
+"""
+
+
+class Model:
+    # the objects are pickled as the tuple of their values, in the order of __slots__, so new fields must be added at
+    # the end of __slots__ and never removed
+    __slots__ = ()
+
+    def __getstate__(self) -> tuple:
+        return self.get_values()
+
+    def __setstate__(self, state: tuple):
+        self.__init__()  # the fields added after the object was pickled keep their default value
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def get_values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class WordEntry(Model):
+    """A word sent by a player, with its points and whether it has been struck, as flags packed in an int."""
+    __slots__ = ('points', 'flags')
+
+    SENT_BY_OTHER_PLAYERS = 1
+    DELETED = 2
+
+    def __init__(self, points: int = 0, flags: int = 0):
+        self.points = points
+        self.flags = flags
+
+    @property
+    def sent_by_other_players(self) -> bool:
+        return bool(self.flags & WordEntry.SENT_BY_OTHER_PLAYERS)
+
+    @sent_by_other_players.setter
+    def sent_by_other_players(self, value: bool):
+        self.flags = self.flags | WordEntry.SENT_BY_OTHER_PLAYERS if value \
+            else self.flags & ~WordEntry.SENT_BY_OTHER_PLAYERS
+
+    @property
+    def deleted(self) -> bool:
+        return bool(self.flags & WordEntry.DELETED)
+
+    @deleted.setter
+    def deleted(self, value: bool):
+        self.flags = self.flags | WordEntry.DELETED if value else self.flags & ~WordEntry.DELETED
+
+    @property
+    def is_valid(self) -> bool:
+        """A word is worth its points if it hasn't been sent by other players nor deleted."""
+        return self.flags == 0
+
+    def to_dict(self) -> dict:
+        return {
+            'points': self.points,
+            'sent_by_other_players': self.sent_by_other_players,
+            'deleted': self.deleted
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data['points'], (cls.SENT_BY_OTHER_PLAYERS if data['sent_by_other_players'] else 0)
+                   | (cls.DELETED if data['deleted'] else 0))
+
+
+class Participant(Model):
+    __slots__ = ('username', 'words', 'result_message_id')
+
+    def __init__(self, username: str = "", words: dict = None, result_message_id: int = None):
+        self.username = username
+        self.words = words if words is not None else {}  # word -> WordEntry, in the order they were sent
+        self.result_message_id = result_message_id  # the message with the words of the player in the group
+
+    def get_points(self) -> int:
+        return sum(entry.points for entry in self.words.values() if entry.is_valid)
+
+    def to_dict(self, with_words: bool = True) -> dict:
+        data = {'username': self.username}
+        if with_words:
+            data['words'] = {word: entry.to_dict() for word, entry in self.words.items()}
+        if self.result_message_id is not None:
+            data['result_message_id'] = self.result_message_id
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data['username'],
+                   {word: WordEntry.from_dict(entry) for word, entry in data.get('words', {}).items()},
+                   data.get('result_message_id'))
+
+
+class Game(Model):
+    __slots__ = ('unix_epoch', 'creator_id', 'creator_username', 'participants', 'is_finished', 'ingame_timer',
+                 'lang', 'dim', 'newgame_message_id', 'table_str', 'table_grid', 'board_words', 'winners',
+                 'scores')
+
+    def __init__(self, unix_epoch: int = 0, creator_id: int = None, creator_username: str = "", lang: str = 'eng',
+                 dim: str = '4x4', newgame_message_id: int = None, is_finished: bool = False):
+        self.unix_epoch = unix_epoch
+        self.creator_id = creator_id
+        self.creator_username = creator_username
+        self.participants = {}  # user_id -> Participant
+        self.is_finished = is_finished
+        self.ingame_timer = None  # the deadline of the ingame timer, once the board has been dealt
+        self.lang = lang
+        self.dim = dim
+        self.newgame_message_id = newgame_message_id  # the message listing the players who have joined
+        self.table_str = None
+        self.table_grid = None
+        # all the words of the dictionary which can be found on the table, never changed once the board is dealt
+        self.board_words = frozenset()
+        self.winners = None  # user_id -> username, once the game has ended
+        self.scores = None  # user_id -> points, once the game has ended
+
+    def get_scores(self) -> dict:
+        return {user_id: participant.get_points() for user_id, participant in self.participants.items()}
+
+    def to_dict(self, with_participants: bool = True) -> dict:
+        data = {
+            'unix_epoch': self.unix_epoch,
+            'creator': {
+                'id': self.creator_id,
+                'username': self.creator_username
+            },
+            'is_finished': self.is_finished,
+            'ingame_timer': self.ingame_timer,
+            'lang': self.lang,
+            'dim': self.dim,
+            'newgame_message_id': self.newgame_message_id
+        }
+        if with_participants:
+            data['participants'] = {user_id: participant.to_dict() for user_id, participant in self.participants.items()}
+        for key in ('table_str', 'table_grid', 'winners', 'scores'):
+            if getattr(self, key) is not None:
+                data[key] = getattr(self, key)
+        if self.board_words:
+            data['board_words'] = self.board_words
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        newgame_message_id = data.get('newgame_message_id')
+        if data.get('newgame_message') is not None:
+            # the whole message used to be saved: a Message in the databases and a dict in the archive
+            newgame_message_id = data['newgame_message']['message_id']
+        game = cls(data['unix_epoch'], data['creator']['id'], data['creator']['username'], data['lang'], data['dim'],
+                   newgame_message_id, data['is_finished'])
+        game.participants = {user_id: Participant.from_dict(participant)
+                             for user_id, participant in data.get('participants', {}).items()}
+        game.ingame_timer = data.get('ingame_timer')
+        game.table_str = data.get('table_str')
+        game.table_grid = data.get('table_grid')
+        game.board_words = data.get('board_words') or frozenset()
+        game.winners = data.get('winners')
+        game.scores = data.get('scores')
+        if game.scores is None and game.winners is not None and 'participants' in data:
+            game.scores = game.get_scores()  # the game ended before its scores were saved
+        return game
+
+
+# the fields of the statistics only hold immutable values, so that the persistence can tell which statistics have
+# changed by comparing their values, without pickling all of them on each update
+
+class UserStats(Model):
+    __slots__ = ('username', 'played', 'won', 'even', 'lost', 'latest_result', 'latest_points', 'latest_words',
+                 'max_points', 'min_points', 'total_points')
+
+    def __init__(self, username: str = ""):
+        self.username = username
+        self.played = 0
+        self.won = 0
+        self.even = 0
+        self.lost = 0
+        self.latest_result = ""  # "won", "even" or "lost"
+        self.latest_points = 0
+        self.latest_words = ()  # (word, points) for each word sent in the latest game
+        self.max_points = 0
+        self.min_points = 0
+        self.total_points = 0
+
+    def add_game(self, result: str, points: int, words: tuple):
+        self.played += 1
+        setattr(self, result, getattr(self, result) + 1)
+        self.latest_result = result
+        self.latest_points = points
+        self.latest_words = words
+        self.max_points = max(self.max_points, points)
+        self.min_points = points if self.played == 1 else min(self.min_points, points)
+        self.total_points += points
+
+    def get_percentage(self, result: str) -> float:
+        return round(getattr(self, result) / self.played * 100, 2) if self.played else 0
+
+    @property
+    def average_points(self) -> float:
+        return round(self.total_points / self.played, 2) if self.played else 0
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        stats = cls(data['username'])
+        matches = data['matches']
+        stats.played = matches['played']
+        stats.won = matches['won']['value']
+        stats.even = matches['even']['value']
+        stats.lost = matches['lost']['value']
+        stats.latest_result = matches['latest']['won']
+        stats.latest_points = matches['latest']['points']
+        stats.latest_words = tuple(matches['latest']['words'].items())
+        stats.max_points = data['points']['max']
+        stats.min_points = data['points']['min']
+        stats.total_points = data['points']['total']
+        return stats
+
+
+class GroupStats(Model):
+    __slots__ = ('matches', 'points', 'players')
+
+    def __init__(self):
+        self.matches = 0
+        self.points = 0
+        self.players = frozenset()  # the ids of the users who have joined a game in the group
+
+    def add_game(self, points: int):
+        self.matches += 1
+        self.points += points
+
+    def add_player(self, user_id: int):
+        self.players = self.players | {user_id}
+
+    @property
+    def average(self) -> int:
+        return int(self.points / self.matches) if self.matches else 0
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        # the players were saved with their initial statistics, next to the statistics of the group
+        stats = cls()
+        stats.matches = data['matches']
+        stats.points = data['points']
+        stats.players = frozenset(key for key in data if isinstance(key, int))
+        return stats
@@ -0,0 +1,428 @@
+import io
+import logging
+import os
+import pickle
+import sqlite3
+from collections import defaultdict
+from threading import RLock
+
+from telegram import Bot
+from telegram.ext import BasePersistence
+
+from models import Game, Participant, WordEntry, UserStats, GroupStats
+
+logger = logging.getLogger(__name__)
+
+schema = """
+CREATE TABLE IF NOT EXISTS bot_data (key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS user_stats (user_id INTEGER PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS group_stats (group_id INTEGER PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS group_user_stats (group_id INTEGER, user_id INTEGER, value BLOB,
+                                             PRIMARY KEY (group_id, user_id));
+CREATE TABLE IF NOT EXISTS running_games (group_id INTEGER PRIMARY KEY, unix_epoch INTEGER);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER, key TEXT, value BLOB, PRIMARY KEY (chat_id, key));
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS games (chat_id INTEGER, unix_epoch INTEGER, value BLOB, PRIMARY KEY (chat_id, unix_epoch));
+CREATE TABLE IF NOT EXISTS participants (chat_id INTEGER, unix_epoch INTEGER, user_id INTEGER, value BLOB,
+                                         PRIMARY KEY (chat_id, unix_epoch, user_id));
+CREATE TABLE IF NOT EXISTS words (chat_id INTEGER, unix_epoch INTEGER, user_id INTEGER, word TEXT, points INTEGER,
+                                  sent_by_other_players INTEGER, deleted INTEGER,
+                                  PRIMARY KEY (chat_id, unix_epoch, user_id, word));
+"""
+
+# the columns of the primary key of each table, the remaining ones are the value of the row
+tables_keys = {
+    'bot_data': ('key',),
+    'user_stats': ('user_id',),
+    'group_stats': ('group_id',),
+    'group_user_stats': ('group_id', 'user_id'),
+    'running_games': ('group_id',),
+    'chat_data': ('chat_id', 'key'),
+    'user_data': ('user_id',),
+    'games': ('chat_id', 'unix_epoch'),
+    'participants': ('chat_id', 'unix_epoch', 'user_id'),
+    'words': ('chat_id', 'unix_epoch', 'user_id', 'word'),
+}
+tables_values = {
+    'running_games': ('unix_epoch',),
+    'words': ('points', 'sent_by_other_players', 'deleted'),
+}
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence on an SQLite database in WAL mode.
+    bot_data and chat_data are split into rows (one per game, participant, word, user and group stats...), and only
+    the rows which have changed since they were last written are saved on each update.
+    Running games in bot_data['games'] are saved as references to the games in the chat_data of their group, so
+    that they are still the same objects once they are loaded.
+    Only what an update of a chat can have changed is saved with it: the games of a group which haven't ended yet, the
+    running games of the user of a private chat, and the statistics of the group and of its players, or of the user.
+    All the statistics are saved when the persistence is flushed.
+    Games and participants are saved in the dict layout of models.py, and statistics as pickled models. Rows saved
+    before the models are converted when they are loaded, and are rewritten the next time they're saved, except for the
+    finished games, which are compacted once when they're loaded.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        # BasePersistence.__new__ wraps the get_* and update_* methods so that all the data is deep copied on each
+        # update to replace the Bot instances: here rows are pickled one at a time, replacing the bot through
+        # persistent ids instead
+        return object.__new__(cls)
+
+    def __init__(self, filename: str, legacy_filename: str = None, store_user_data: bool = True,
+                 store_chat_data: bool = True, store_bot_data: bool = True):
+        super().__init__(store_user_data=store_user_data,
+                         store_chat_data=store_chat_data,
+                         store_bot_data=store_bot_data)
+        self.filename = filename
+        self.legacy_filename = legacy_filename
+        self._lock = RLock()
+        self._connection = None
+        self._rows = {table: {} for table in tables_keys}  # the rows as they are in the database
+        # key prefix -> keys of the rows starting with it, e.g. all the words of a chat or of a game
+        self._scopes = {table: {} for table in tables_keys}
+        self._stats = {}  # (table, key) -> values of the statistics when they were last pickled, and their row
+        self._games = {}  # (chat_id, unix_epoch) -> game, shared between bot_data and chat_data
+        # the games whose rows have been written once they had ended, and won't change anymore
+        self._ended_games = set()
+        self._user_data = None
+        self._chat_data = None
+        self._bot_data = None
+
+    def get_user_data(self):
+        self._load()
+        return self._user_data
+
+    def get_chat_data(self):
+        self._load()
+        return self._chat_data
+
+    def get_bot_data(self):
+        self._load()
+        return self._bot_data
+
+    def get_conversations(self, name: str) -> dict:
+        return {}
+
+    def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        self._write({'user_data': {(user_id,): (self._dumps(data),)}}, (user_id,), tables=['user_data'])
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        with self._lock:
+            try:
+                rows = {'chat_data': {}}
+                for key, value in list(data.items()):
+                    if key != 'games':
+                        rows['chat_data'][(chat_id, key)] = (self._dumps(value),)
+                games = {(chat_id, game.unix_epoch): game for game in list(data.get('games', []))}
+            except RuntimeError:
+                # the handlers run concurrently: the chat has changed while it was being read, and since the
+                # persistence is updated after each update, it will be saved the next time
+                logger.debug(f"Chat {chat_id} changed while it was being saved")
+                return
+            self._write(rows, (chat_id,))
+
+            for game_key in self._get_keys_in_scope('games', (chat_id,)):
+                if game_key not in games:  # archived, or the lobby has been canceled
+                    self._write({table: {} for table in ['games', 'participants', 'words']}, game_key)
+            user_ids = set()
+            for game_key, game in games.items():
+                if game_key not in self._ended_games:
+                    self._write_game(game_key, game)
+                    user_ids.update(game.participants)
+            if chat_id > 0:
+                # words are sent in private chats, so the running games of the user are saved with them
+                bot_data = self._bot_data or {}
+                for group_id in list(bot_data.get('user_games', {}).get(chat_id, [])):
+                    game = bot_data.get('games', {}).get(group_id)
+                    if game is not None:
+                        self._write_game((group_id, game.unix_epoch), game)
+                user_ids = {chat_id}
+            self._write_chat_stats(chat_id, user_ids)
+
+    def update_bot_data(self, data: dict) -> None:
+        with self._lock:
+            try:
+                rows = {table: {} for table in ['bot_data', 'running_games']}
+                for key, value in list(data.items()):
+                    if key not in ('games', 'stats'):
+                        rows['bot_data'][(key,)] = (self._dumps(value),)
+                stats = data.get('stats', {})
+                if stats:
+                    rows['bot_data'][('stats',)] = (self._dumps({key: {} if key in ('users', 'groups', 'group_users')
+                                                                 else stats[key] for key in stats}),)
+                if data is not self._bot_data:
+                    # bot_data which wasn't loaded from this database, e.g. copied from another one, is saved whole
+                    rows.update(self._get_stats_rows(stats))
+                if 'games' in data:
+                    rows['bot_data'][('games',)] = (self._dumps({}),)
+                for group_id, game in list(data.get('games', {}).items()):
+                    rows['running_games'][(group_id,)] = (game.unix_epoch,)
+            except RuntimeError:
+                logger.debug("The bot data changed while it was being saved")
+                return
+            self._write(rows, ())
+            self._bot_data = data
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._bot_data is not None:
+                try:
+                    self._write(self._get_stats_rows(self._bot_data.get('stats', {})), None)
+                except RuntimeError:
+                    logger.debug("The statistics changed while they were being saved")
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.filename, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(schema)
+        return self._connection
+
+    def _load(self):
+        with self._lock:
+            if self._chat_data is not None:
+                return
+            connection = self._connect()
+            for table in self._rows:
+                columns = tables_keys[table] + tables_values.get(table, ('value',))
+                n_keys = len(tables_keys[table])
+                for row in connection.execute(f"SELECT {', '.join(columns)} FROM {table}"):
+                    self._set_row(table, tuple(row[:n_keys]), tuple(row[n_keys:]))
+
+            if not any(self._rows.values()) and self.legacy_filename and os.path.isfile(self.legacy_filename):
+                self._migrate_legacy()
+                return
+
+            self._user_data = defaultdict(dict)
+            for (user_id,), (value,) in self._rows['user_data'].items():
+                self._user_data[user_id] = self._loads(value)
+
+            self._chat_data = defaultdict(dict)
+            for (chat_id, key), (value,) in self._rows['chat_data'].items():
+                self._chat_data[chat_id][key] = self._loads(value)
+            legacy_games = set()
+            for (chat_id, unix_epoch), (value,) in sorted(self._rows['games'].items()):
+                data = self._loads(value)
+                game = Game.from_dict(data)
+                if 'newgame_message' in data:
+                    legacy_games.add((chat_id, unix_epoch))
+                self._games[(chat_id, unix_epoch)] = game
+                self._chat_data[chat_id].setdefault('games', []).append(game)
+            for (chat_id, unix_epoch, user_id), (value,) in self._rows['participants'].items():
+                self._games[(chat_id, unix_epoch)].participants[user_id] = Participant.from_dict(self._loads(value))
+            for (chat_id, unix_epoch, user_id, word), (points, sent_by_other_players, deleted) \
+                    in self._rows['words'].items():
+                flags = (WordEntry.SENT_BY_OTHER_PLAYERS if sent_by_other_players else 0) \
+                    | (WordEntry.DELETED if deleted else 0)
+                self._games[(chat_id, unix_epoch)].participants[user_id].words[word] = WordEntry(points, flags)
+            for game_key, game in self._games.items():
+                if game.winners is not None and game.scores is None:
+                    game.scores = game.get_scores()  # the game ended before its scores were saved
+                    legacy_games.add(game_key)
+
+            self._bot_data = {}
+            for (key,), (value,) in self._rows['bot_data'].items():
+                self._bot_data[key] = self._loads(value)
+            if 'stats' in self._bot_data:
+                for (user_id,), (value,) in self._rows['user_stats'].items():
+                    self._bot_data['stats']['users'][user_id] = self._load_stats(UserStats, value)
+                for (group_id,), (value,) in self._rows['group_stats'].items():
+                    self._bot_data['stats']['groups'][group_id] = self._load_stats(GroupStats, value)
+                for (group_id, user_id), (value,) in self._rows['group_user_stats'].items():
+                    self._bot_data['stats'].setdefault('group_users', {}).setdefault(group_id, {})[user_id] = \
+                        self._load_stats(UserStats, value)
+            for (group_id,), (unix_epoch,) in self._rows['running_games'].items():
+                if (group_id, unix_epoch) in self._games:
+                    self._bot_data.setdefault('games', {})[group_id] = self._games[(group_id, unix_epoch)]
+
+            if legacy_games:
+                self._compact(sorted(legacy_games))
+            self._ended_games = {game_key for game_key, game in self._games.items() if game.scores is not None}
+
+    def _migrate_legacy(self):
+        logger.info(f"Migrating {self.legacy_filename} to {self.filename}...")
+        try:
+            with open(self.legacy_filename, 'rb') as f:
+                data = self.insert_bot(pickle.load(f))
+        except Exception as e:
+            raise TypeError(f"Something went wrong unpickling {self.legacy_filename}") from e
+        self._user_data = defaultdict(dict, data.get('user_data') or {})
+        self._chat_data = defaultdict(dict, data.get('chat_data') or {})
+        self._bot_data = data.get('bot_data') or {}
+        for chat_data in self._chat_data.values():
+            if 'games' in chat_data:
+                chat_data['games'] = [Game.from_dict(game) for game in chat_data['games']]
+        # the running games were pickled as copies of the games in chat_data, point them to the ones in chat_data
+        for group_id, game in self._bot_data.get('games', {}).items():
+            self._bot_data['games'][group_id] = Game.from_dict(game)
+            for chat_game in self._chat_data[group_id].get('games', []):
+                if chat_game.unix_epoch == game['unix_epoch']:
+                    self._bot_data['games'][group_id] = chat_game
+        stats = self._bot_data.get('stats', {})
+        for user_id, user_stats in stats.get('users', {}).items():
+            stats['users'][user_id] = UserStats.from_dict(user_stats)
+        for group_id, group_stats in stats.get('groups', {}).items():
+            stats['groups'][group_id] = GroupStats.from_dict(group_stats)
+        for user_id, user_data in self._user_data.items():
+            self.update_user_data(user_id, user_data)
+        for chat_id, chat_data in self._chat_data.items():
+            self.update_chat_data(chat_id, chat_data)
+        self.update_bot_data(self._bot_data)
+        self._write(self._get_stats_rows(self._bot_data.get('stats', {})), ())
+        logger.info(f"Migrated {self.legacy_filename} to {self.filename}.")
+
+    def _compact(self, game_keys: list):
+        # the games used to be saved with the whole message announcing them, bot included, instead of its id, and
+        # without their scores: they're saved again as they are now and the space they took in the database is freed
+        logger.info(f"Compacting {len(game_keys)} games in {self.filename}...")
+        size = os.path.getsize(self.filename)
+        for game_key in game_keys:
+            row = (self._dumps(self._games[game_key].to_dict(with_participants=False)),)
+            self._write({'games': {game_key: row}}, game_key)
+        connection = self._connect()
+        connection.execute("VACUUM")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(f"Compacted {self.filename} from {size // 1024} KB to {os.path.getsize(self.filename) // 1024} KB.")
+
+    def _get_game_rows(self, rows: dict, game_key: tuple, game: Game):
+        rows['games'][game_key] = (self._dumps(game.to_dict(with_participants=False)),)
+        for user_id, participant in game.participants.items():
+            rows['participants'][game_key + (user_id,)] = (self._dumps(participant.to_dict(with_words=False)),)
+            for word, entry in participant.words.items():
+                rows['words'][game_key + (user_id, word)] = (entry.points,
+                                                             int(entry.sent_by_other_players),
+                                                             int(entry.deleted))
+
+    def _write_game(self, game_key: tuple, game: Game):
+        rows = {table: {} for table in ['games', 'participants', 'words']}
+        try:
+            self._get_game_rows(rows, game_key, game)
+        except RuntimeError:
+            logger.debug(f"The game {game_key} changed while it was being saved")
+            return
+        self._write(rows, game_key)
+        if game.scores is not None:
+            # the scores are the last thing set when a game ends, its rows won't change once it has them
+            self._ended_games.add(game_key)
+
+    def _write_chat_stats(self, chat_id: int, user_ids: set):
+        # the statistics of the group and of its players, or of the user of a private chat, are the only ones
+        # which can have changed with an update of the chat
+        stats = (self._bot_data or {}).get('stats')
+        if not stats:
+            return
+        rows = {table: {} for table in ['user_stats', 'group_stats', 'group_user_stats']}
+        try:
+            for user_id in user_ids:
+                if user_id in stats['users']:
+                    rows['user_stats'][(user_id,)] = self._get_stats_row('user_stats', (user_id,),
+                                                                         stats['users'][user_id])
+            if chat_id in stats['groups']:
+                rows['group_stats'][(chat_id,)] = self._get_stats_row('group_stats', (chat_id,),
+                                                                      stats['groups'][chat_id])
+            for user_id, user_stats in list(stats.get('group_users', {}).get(chat_id, {}).items()):
+                key = (chat_id, user_id)
+                rows['group_user_stats'][key] = self._get_stats_row('group_user_stats', key, user_stats)
+        except RuntimeError:
+            logger.debug(f"The statistics of chat {chat_id} changed while they were being saved")
+            return
+        self._write(rows, None)
+
+    def _get_stats_rows(self, stats: dict) -> dict:
+        rows = {table: {} for table in ['user_stats', 'group_stats', 'group_user_stats']}
+        for user_id, user_stats in list(stats.get('users', {}).items()):
+            rows['user_stats'][(user_id,)] = self._get_stats_row('user_stats', (user_id,), user_stats)
+        for group_id, group_stats in list(stats.get('groups', {}).items()):
+            rows['group_stats'][(group_id,)] = self._get_stats_row('group_stats', (group_id,), group_stats)
+        for group_id, group_users in list(stats.get('group_users', {}).items()):
+            for user_id, user_stats in list(group_users.items()):
+                key = (group_id, user_id)
+                rows['group_user_stats'][key] = self._get_stats_row('group_user_stats', key, user_stats)
+        return rows
+
+    def _get_stats_row(self, table: str, key: tuple, stats) -> tuple:
+        # the statistics are pickled again only if their values have changed
+        values = stats.get_values()
+        saved = self._stats.get((table, key))
+        if saved is None or saved[0] != values:
+            saved = self._stats[(table, key)] = (values, (self._dumps(stats),))
+        return saved[1]
+
+    def _load_stats(self, model, value: bytes):
+        stats = self._loads(value)
+        return stats if isinstance(stats, model) else model.from_dict(stats)
+
+    def _write(self, rows: dict, scope, tables: list = None):
+        """
+        Save the given rows, and delete the rows of the same tables which are in scope, i.e. whose key starts with
+        scope, but aren't in rows. No row is deleted if scope is None.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for table in tables or rows:
+                    written = self._rows[table]
+                    keys = tables_keys[table]
+                    columns = keys + tables_values.get(table, ('value',))
+                    changed = [key + value for key, value in rows[table].items() if written.get(key) != value]
+                    deleted = [key for key in self._get_keys_in_scope(table, scope) if key not in rows[table]] \
+                        if scope is not None else []
+                    if changed:
+                        connection.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                                               f"VALUES ({', '.join('?' * len(columns))})", changed)
+                        for row in changed:
+                            self._set_row(table, row[:len(keys)], row[len(keys):])
+                    if deleted:
+                        connection.executemany(f"DELETE FROM {table} WHERE "
+                                               f"{' AND '.join(f'{key} = ?' for key in keys)}", deleted)
+                        for key in deleted:
+                            self._delete_row(table, key)
+
+    def _get_keys_in_scope(self, table: str, scope: tuple) -> list:
+        if not scope:
+            return list(self._rows[table])
+        if len(scope) == len(tables_keys[table]):
+            return [scope] if scope in self._rows[table] else []
+        return list(self._scopes[table].get(scope, ()))
+
+    def _set_row(self, table: str, key: tuple, value: tuple):
+        if key not in self._rows[table]:
+            # the rows are written by chat and by game, i.e. the first one or two columns of their key
+            for length in range(1, min(3, len(key))):
+                self._scopes[table].setdefault(key[:length], set()).add(key)
+        self._rows[table][key] = value
+
+    def _delete_row(self, table: str, key: tuple):
+        del self._rows[table][key]
+        if table == 'games':
+            self._ended_games.discard(key)
+        for length in range(1, min(3, len(key))):
+            keys = self._scopes[table][key[:length]]
+            keys.discard(key)
+            if not keys:
+                del self._scopes[table][key[:length]]
+
+    def _dumps(self, obj) -> bytes:
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda o: 'bot' if isinstance(o, Bot) else None
+        pickler.dump(obj)
+        return buffer.getvalue()
+
+    def _loads(self, data: bytes):
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = lambda pid: self.bot
+        return unpickler.load()
@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+from collections import Counter
+from time import sleep, monotonic
+
+interval = 0.01  # seconds between two samples
+max_duration = 300  # seconds
+
+__lock = threading.Lock()
+
+
+def profile(duration: float) -> str:
+    """
+    Sample the stacks of all the threads of the process for duration seconds, and return them in the collapsed stack
+    format, a line with the thread name, the frames from the outermost and the number of samples, which can be turned
+    into a flame graph by flamegraph.pl or speedscope.
+    Only one profile can run at a time, None is returned if another one is running.
+    """
+    if not __lock.acquire(blocking=False):
+        return None
+    try:
+        stacks = Counter()
+        own_id = threading.get_ident()
+        deadline = monotonic() + min(duration, max_duration)
+        while monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stacks[__get_stack(names.get(thread_id, str(thread_id)), frame)] += 1
+            sleep(interval)
+        return "".join(f"{stack} {samples}\n" for stack, samples in stacks.most_common())
+    finally:
+        __lock.release()
+
+
+def __get_stack(thread_name: str, frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name}({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    # the samples are separated from the stack by a space
+    return ";".join(reversed(frames)).replace(" ", "_")
@@ -0,0 +1,46 @@
+from bisect import bisect_right
+from threading import Lock
+
+__lock = Lock()
+# group_id -> the number of games which have ended in the group and, for each player, the usernames, the numbers of
+# the games they've played and the sum of their points up to each of them, so that the points of a player in the last
+# n games are the difference of two sums
+__rankings = {}
+
+
+def add_game(group_id: int, game):
+    """Add the scores of a game which has just ended to the ranking of its group, if it's been built."""
+    with __lock:
+        if group_id in __rankings:
+            __add_game(__rankings[group_id], game)
+
+
+def get_ranking(group_id: int, last_n: int, get_games) -> tuple:
+    """
+    Return the number of games which have ended in the group and, for each player of the last_n ones, their username
+    and points, from the highest. get_games returns all the games of the group which have ended, from the oldest, and
+    is only called the first time the ranking of the group is asked for.
+    """
+    with __lock:
+        if group_id not in __rankings:
+            ranking = __rankings[group_id] = {'games': 0, 'players': {}}
+            for game in get_games():
+                __add_game(ranking, game)
+        ranking = __rankings[group_id]
+        since = ranking['games'] - min(last_n, ranking['games'])
+        players_points = []
+        for user_id, (username, numbers, totals) in ranking['players'].items():
+            i = bisect_right(numbers, since)
+            if i < len(numbers):
+                players_points.append((user_id, username, totals[-1] - (totals[i - 1] if i else 0)))
+    players_points.sort(key=lambda player: player[2], reverse=True)
+    return ranking['games'], players_points
+
+
+def __add_game(ranking: dict, game):
+    ranking['games'] += 1
+    for user_id, points in game.scores.items():
+        username, numbers, totals = ranking['players'].get(user_id, (None, [], []))
+        numbers.append(ranking['games'])
+        totals.append((totals[-1] if totals else 0) + points)
+        ranking['players'][user_id] = (game.participants[user_id].username, numbers, totals)
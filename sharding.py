@@ -0,0 +1,242 @@
+"""
+Sharded deployment of the bot, run with: python sharding.py
+The groups are partitioned by chat_id across SHARDS worker processes (default: one per core), each one with its own
+dispatcher and database. This front process receives the updates, by polling or from the JSON lines file in
+UPDATE_FEED, and routes each one to the shard owning its chat, user_id % SHARDS for a private chat. The words sent in a
+private chat are routed instead to the shard of the running game the user has joined, or else of the latest game
+they've joined, which the shards report whenever a user joins or leaves a game and whenever a game starts or ends.
+The overall statistics of the users are kept by every shard, so that /stats and /top show the same ones everywhere:
+when a game ends, its shard sends the results of each player to all the other shards.
+The first time they're started, the shards take their chats from the database of the single process bot, migrated from
+its legacy pickle file if needed, and all the overall statistics of the users.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from queue import Queue
+from threading import Thread, Event
+from time import sleep
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher, JobQueue
+from telegram.utils.request import Request
+
+import boards
+import boggle_telegram_bot as boggle
+import delivery
+import dictionary
+from metrics import MetricsRequest, start_metrics_server
+from persistence import SQLitePersistence
+
+logger = logging.getLogger(__name__)
+
+shards = int(os.environ.get("SHARDS") or os.cpu_count())
+update_feed = os.environ.get("UPDATE_FEED")  # a file with an update as JSON per line, instead of polling Telegram
+
+
+def get_shard(update: Update, user_games: dict, running_groups=frozenset()) -> int:
+    """
+    Return the shard handling the update, given the games joined by each user as user_id -> {group_id: shard} and the
+    ids of the groups whose game is running.
+    """
+    chat = update.effective_chat
+    if chat is None:
+        user = update.effective_user
+        return user.id % shards if user else 0
+    message = update.effective_message
+    is_word = message is not None and message.text is not None and not message.text.startswith("/")
+    if chat.type == chat.PRIVATE and is_word and user_games.get(chat.id):
+        games = list(user_games[chat.id].items())
+        for group_id, shard in reversed(games):
+            if group_id in running_groups:
+                return shard  # the running game of the user, even if they've joined a newer one which hasn't started
+        return games[-1][1]  # the latest game joined by the user
+    return chat.id % shards
+
+
+def get_shard_filename(shard: int) -> str:
+    root, ext = os.path.splitext(boggle.db_filename)
+    return f"{root}_shard{shard}{ext}"
+
+
+def run_worker(shard: int, updates, events, all_updates: list):
+    """
+    Handle the updates routed to this shard until None is received, reporting the games joined by the users and the
+    games which start or end, and sending the results of the players of its games to the other shards.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the front process stops the workers
+    if boards.pool_filename:
+        boards.pool_filename = f"{boards.pool_filename}_shard{shard}"
+
+    filename = get_shard_filename(shard)
+    if not os.path.isfile(filename) and os.path.isfile(boggle.db_filename):  # migrated by the front process
+        __seed_shard(shard, filename)
+    persistence = SQLitePersistence(filename=filename, store_user_data=False)
+    bot = Bot(boggle.token, base_url=boggle.bot_api_url,
+              request=MetricsRequest(con_pool_size=boggle.dispatcher_workers + delivery.workers + 1, read_timeout=10))
+    update_queue = Queue()
+    job_queue = JobQueue()
+    dp = Dispatcher(bot, update_queue, workers=boggle.dispatcher_workers, job_queue=job_queue,
+                    persistence=persistence, use_context=True)
+    job_queue.set_dispatcher(dp)
+    boggle.register_handlers(dp)
+
+    boggle.user_games_listeners.append(lambda user_id, group_id, joined: events.put((shard, user_id, group_id, joined)))
+    boggle.running_games_listeners.append(lambda group_id, running: events.put((shard, None, group_id, running)))
+
+    def send_user_results(*results):
+        # the other shards add them to the statistics of the user as well
+        for other_shard, queue in enumerate(all_updates):
+            if other_shard != shard:
+                queue.put({'user_results': results})
+
+    boggle.user_results_listeners.append(send_user_results)
+
+    for user_id, group_ids in dp.bot_data['user_games'].items():
+        for group_id in group_ids:
+            events.put((shard, user_id, group_id, True))
+    for group_id, game in dp.bot_data['games'].items():
+        if game.table_grid and not game.is_finished:
+            events.put((shard, None, group_id, True))
+
+    if boggle.metrics_port:
+        start_metrics_server(int(boggle.metrics_port) + 1 + shard)  # the front process doesn't serve any metrics
+    dictionary.load_dictionaries()  # already compiled by the front process
+    boards.start_board_pool()
+    delivery.start_notifications()
+    job_queue.start()
+    Thread(target=dp.start, name=f"dispatcher_shard{shard}").start()
+    logger.info(f"Shard {shard} started with database {filename}")
+
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        if 'user_results' in data:  # a game of another shard has ended
+            user_id = data['user_results'][0]
+            boggle.add_user_results(dp.bot_data, *data['user_results'])
+            persistence.update_chat_data(user_id, dp.chat_data[user_id])  # saved with the private chat of the user
+            continue
+        update_queue.put(Update.de_json(data, bot))
+
+    while dp.running and not update_queue.empty():
+        sleep(0.1)
+    job_queue.stop()
+    dp.stop()
+    dp.update_persistence()
+    persistence.flush()
+    logger.info(f"Shard {shard} stopped")
+
+
+def main():
+    if not all(os.path.isfile(get_shard_filename(shard)) for shard in range(shards)) \
+            and os.path.isfile(boggle.legacy_db_filename):
+        __migrate_legacy()
+    dictionary.load_dictionaries()  # the word lists are compiled once, before the shards load them
+
+    updates = [multiprocessing.Queue() for _ in range(shards)]
+    events = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(shard, updates[shard], events, updates),
+                                       name=f"shard{shard}")
+               for shard in range(shards)]
+    for worker in workers:
+        worker.start()
+
+    user_games = {}  # user_id -> {group_id: shard}
+    running_groups = set()  # the ids of the groups whose game is running
+    Thread(target=__track_games, args=(events, user_games, running_groups), name="user_games", daemon=True).start()
+
+    stop = Event()
+    for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGABRT]:
+        signal.signal(signum, lambda *args: stop.set())
+
+    def route(update: Update):
+        updates[get_shard(update, user_games, running_groups)].put(update.to_dict())
+
+    if update_feed:
+        with open(update_feed) as f:
+            for line in f:
+                if line.strip():
+                    route(Update.de_json(json.loads(line), None))
+        logger.info(f"Routed all the updates of {update_feed}")
+        stop.wait()
+    else:
+        __poll(route, stop)
+
+    for queue in updates:
+        queue.put(None)
+    for worker in workers:
+        worker.join()
+
+
+def __poll(route, stop: Event):
+    bot = Bot(boggle.token, base_url=boggle.bot_api_url, request=Request(read_timeout=15))
+    bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            received = bot.get_updates(offset=offset, timeout=10)
+        except TelegramError as e:
+            logger.warning(f"Could not get the updates: {e}")
+            sleep(1)
+            continue
+        for update in received:
+            route(update)
+            offset = update.update_id + 1
+
+
+def __track_games(events, user_games: dict, running_groups: set):
+    while True:
+        shard, user_id, group_id, joined = events.get()
+        if user_id is None:  # the game of the group has started or ended
+            if joined:
+                running_groups.add(group_id)
+            else:
+                running_groups.discard(group_id)
+        elif joined:
+            user_games.setdefault(user_id, {})[group_id] = shard
+        elif group_id in user_games.get(user_id, {}):
+            del user_games[user_id][group_id]
+            if not user_games[user_id]:
+                del user_games[user_id]
+
+
+def __migrate_legacy():
+    # the shards are seeded from the database of the single process bot, which has to be migrated from its legacy
+    # pickle file first, here so that the shards don't all migrate it at the same time
+    source = SQLitePersistence(filename=boggle.db_filename, legacy_filename=boggle.legacy_db_filename,
+                               store_user_data=False)
+    source.get_bot_data()
+    source.flush()
+
+
+def __seed_shard(shard: int, filename: str):
+    # the first time a shard is started, it takes the chats it owns from the database of the single process bot
+    logger.info(f"Copying the chats of shard {shard} from {boggle.db_filename} to {filename}")
+    source = SQLitePersistence(filename=boggle.db_filename, store_user_data=False)
+    target = SQLitePersistence(filename=filename, store_user_data=False)
+    for chat_id, chat_data in source.get_chat_data().items():
+        if chat_id % shards == shard:
+            target.update_chat_data(chat_id, chat_data)
+    bot_data = dict(source.get_bot_data())
+    if 'games' in bot_data:
+        bot_data['games'] = {group_id: game for group_id, game in bot_data['games'].items()
+                             if group_id % shards == shard}
+    if 'stats' in bot_data:
+        # the statistics of the users are copied to every shard, those of the groups and of the users in each group
+        # only to the shard of the group
+        bot_data['stats'] = {key: ({group_id: stats for group_id, stats in bot_data['stats'][key].items()
+                                    if group_id % shards == shard} if key != 'users' else bot_data['stats'][key])
+                             for key in bot_data['stats']}
+    bot_data.pop('user_games', None)  # rebuilt from the games of the shard
+    target.update_bot_data(bot_data)
+    target.flush()
+    source.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+from math import sqrt
+
+__neighbours = {}
+
+
+def get_table_grid(table_list: list) -> str:
+    """
+    Return the table as a flat string, one lowercase letter per cell from the top left corner row by row, with "Qu"
+    stored as "q" the same way the dictionary stores it.
+    """
+    return "".join(letter.lower() if letter != "Qu" else "q" for letter in table_list)
+
+
+def get_grid_neighbours(grid: str) -> tuple:
+    """Return the indices of the neighbours of each cell of the grid."""
+    # the neighbours only depend on the table dimensions, so they're computed once per dimension
+    cells = len(grid)
+    if cells not in __neighbours:
+        row_col_num = int(sqrt(cells))
+        __neighbours[cells] = tuple(tuple(r * row_col_num + c
+                                          for r in range(max(0, row - 1), min(row_col_num, row + 2))
+                                          for c in range(max(0, col - 1), min(row_col_num, col + 2))
+                                          if (r, c) != (row, col))
+                                    for row in range(row_col_num) for col in range(row_col_num))
+    return __neighbours[cells]
+
+
+def solve_board(grid: str, dictionary) -> set:
+    """Return all the words of the dictionary which can be traced on the table grid."""
+    neighbours = get_grid_neighbours(grid)
+    child = dictionary.child
+    is_word = dictionary.is_word
+    found = set()
+    # the stack of the search, one level per letter of the current path: the cell, the dictionary node reached
+    # and the index of the next neighbour to try, with the visited cells as a bitmask
+    cells = len(grid)
+    path = [0] * cells
+    nodes = [0] * cells
+    next_neighbour = [0] * cells
+
+    for start in range(cells):
+        node = child(dictionary.root, grid[start])
+        if node == -1:
+            continue
+        if is_word(node):
+            found.add(grid[start])
+        path[0] = start
+        nodes[0] = node
+        next_neighbour[0] = 0
+        visited = 1 << start
+        depth = 0
+        while depth >= 0:
+            position = path[depth]
+            options = neighbours[position]
+            index = next_neighbour[depth]
+            if index == len(options):
+                visited ^= 1 << position
+                depth -= 1
+                continue
+            next_neighbour[depth] = index + 1
+            next_pos = options[index]
+            if visited >> next_pos & 1:
+                continue
+            node = child(nodes[depth], grid[next_pos])
+            if node == -1:
+                continue
+            depth += 1
+            path[depth] = next_pos
+            nodes[depth] = node
+            next_neighbour[depth] = 0
+            visited |= 1 << next_pos
+            if is_word(node):
+                # the only allocation of the search, once per word found
+                found.add("".join([grid[p] for p in path[:depth + 1]]))
+
+    return found
+
+
+def can_trace_word(word: str, grid: str) -> bool:
+    """Check a single word against the table grid, following the rules of Boggle."""
+    neighbours = get_grid_neighbours(grid)
+    last = len(word) - 1
+    if last < 0:
+        return False
+    path = [0] * len(word)
+    next_neighbour = [0] * len(word)
+
+    for start in range(len(grid)):
+        if grid[start] != word[0]:
+            continue
+        if last == 0:
+            return True
+        path[0] = start
+        next_neighbour[0] = 0
+        visited = 1 << start
+        depth = 0
+        while depth >= 0:
+            position = path[depth]
+            options = neighbours[position]
+            index = next_neighbour[depth]
+            if index == len(options):
+                visited ^= 1 << position
+                depth -= 1
+                continue
+            next_neighbour[depth] = index + 1
+            next_pos = options[index]
+            if visited >> next_pos & 1 or grid[next_pos] != word[depth + 1]:
+                continue
+            depth += 1
+            if depth == last:
+                return True
+            path[depth] = next_pos
+            next_neighbour[depth] = 0
+            visited |= 1 << next_pos
+
+    return False
+
+
+def get_points_for_word(word: str, dim: str) -> int:
+    length = len(word)
+    if length < 3:
+        return 0
+    elif length == 3:
+        if dim == "4x4":
+            return 1
+        elif dim == "5x5":
+            return 0
+    elif length == 4:
+        return 1
+    elif length == 5:
+        return 2
+    elif length == 6:
+        return 3
+    elif length == 7:
+        return 5
+    else:
+        return 11
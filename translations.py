@@ -188,6 +188,10 @@ translations = {
         'ita': "Ehi, hai digitato una parola impossibile da comporre con queste lettere, quindi l'ho scartata.",
         'eng': "Hey, you've sent me an impossible word to make using these letters, so I've discarded it."
     },
+    'received_dm_but_word_not_in_dictionary': {
+        'ita': "Ehi, la parola {} non è nel mio dizionario, quindi l'ho scartata.",
+        'eng': "Hey, the word {} isn't in my dictionary, so I've discarded it."
+    },
     'received_dm_but_q_without_u': {
         'ita': "Non puoi usare la lettera Q senza che sia seguita da una U! Ho scartato la parola.",
         'eng': "You can't use the letter Q without it being followed by U! I've discarded your last word."
@@ -285,6 +289,30 @@ translations = {
                "cioè {}:",
         'eng': "You haven't played {} games yet. I'll show you the ranking for all the games you've played ({}):"
     },
+    'wrong_format_after_top_command': {
+        'ita': "Il comando /top può essere seguito dalla classifica da mostrare: points per i punti totali, wins per "
+               "la percentuale di vittorie o average per la media di punti per partita.\nIl formato è: /top [points|wins|"
+               "average]",
+        'eng': "The /top command can be followed by the leaderboard to show: points for the total points, wins for the "
+               "percentage of games won or average for the average points per game.\nThe format is: /top [points|wins|"
+               "average]"
+    },
+    'no_players_for_top_command': {
+        'ita': "Non ci sono ancora abbastanza partite per questa classifica.",
+        'eng': "There aren't enough games for this leaderboard yet."
+    },
+    'top_points': {
+        'ita': "Ecco la classifica per punti totali:",
+        'eng': "Here's the leaderboard by total points:"
+    },
+    'top_wins': {
+        'ita': "Ecco la classifica per percentuale di vittorie:",
+        'eng': "Here's the leaderboard by percentage of games won:"
+    },
+    'top_average': {
+        'ita': "Ecco la classifica per media di punti per partita:",
+        'eng': "Here's the leaderboard by average points per game:"
+    },
     'isthere_words': {
         'ita': "Parole <b>giocate</b>:\n{}\n\nParole <b>non giocate</b>:\n{}",
         'eng': "Words <b>played</b>:\n{}\n\nWords <b>not played</b>:\n{}"
@@ -591,6 +619,8 @@ translations = {
                "Usa /kick per far uscire qualcuno da una partita che hai creato.\n"
                "Usa /kill per annullare una partita che hai creato.\n"
                "Usa /stats per dare un'occhiata alle tue statistiche o a quelle del gruppo.\n"
+               "Usa /top [points|wins|average] per vedere la classifica del gruppo, o di tutti i giocatori in una chat "
+               "privata.\n"
                "Usa /settings per modificare le impostazioni per te o per un gruppo.\n"
                "Usa /notify per ricevere una notifica quando viene creata una partita.\n"
                "Usa /rules per visualizzare le regole del Paroliere.\n"
@@ -608,6 +638,8 @@ translations = {
                "Use /kick to remove a player from a game you've created.\n"
                "Use /kill to cancel a game you've created.\n"
                "Use /stats to check your statistics.\n"
+               "Use /top [points|wins|average] to see the leaderboard of the group, or of all the players in a private "
+               "chat.\n"
                "Use /notify to receive a notification when a new game is created.\n"
                "Use /settings to change settings for you or for a group.\n"
                "Use /rules to show the rules of Boggle.\n"